@@ -1,8 +1,14 @@
+import argparse
+import bisect
+import json
+import multiprocessing
 import os
 import random
-import glob
+import wave
+from collections import OrderedDict, defaultdict
+import numpy as np
 from pydub import AudioSegment
-from collections import defaultdict
+from audio_manifest import load_manifest
 
 # 資料夾路徑
 languages = {
@@ -17,8 +23,16 @@ output_transcript_file = "/home/speech/chipsrin/espnet/egs2/formosa_taigi/asr2/m
 # 語言標籤
 lang_tags = {"english": "[ENG]", "chinese": "[CHN]", "taiwanese": "[TWN]"}
 
+# 配置切換次數和測試集大小
+switch_counts = {2: 16000, 3: 8000}
+base_max_length = 25000  # 25 秒
+seed = 0  # 主種子：第 k 個樣本使用由 (seed, k) 導出的亂數，結果與分片數、行程數無關
 
-os.makedirs(output_audio_folder, exist_ok=True)
+probe_workers = 16  # 平行讀取 WAV 標頭的執行緒數
+
+# 輸出音檔格式：單聲道 16-bit，來源音檔載入時即轉成此格式
+output_sample_rate = 16000
+audio_cache_mb = 2048  # 已解碼來源音檔快取的記憶體上限（LRU 淘汰）；多行程時由各 worker 平分
 
 # 加載語料
 def load_transcripts(language_path, lang):
@@ -29,8 +43,9 @@ def load_transcripts(language_path, lang):
     
     data = []
     
-    # 搜索音檔路徑
-    audio_files = {os.path.basename(f).replace('.wav', ''): f for f in glob.glob(os.path.join(language_path, "audio", "**", "*.wav"), recursive=True)}
+    # 音檔長度由 manifest 取得（只讀標頭，且只處理新增或變更的音檔）
+    durations = load_manifest(os.path.join(language_path, "audio"), num_workers=probe_workers)
+    audio_files = {os.path.basename(f).replace('.wav', ''): f for f in durations}
 
     for line in transcripts:
         parts = line.split()
@@ -44,98 +59,259 @@ def load_transcripts(language_path, lang):
         audio_file = audio_files[audio_file_key]
         transcript = f"{lang_tags[lang]} " + " ".join(parts[1:])  # 加上語言標籤
         
-        try:
-            audio_length = len(AudioSegment.from_file(audio_file))
-            data.append((audio_file, transcript, audio_length, lang))
-        except Exception as e:
-            print(f"音檔加載失敗，跳過：{audio_file}, 錯誤信息：{e}")
-            continue
+        audio_length = durations[audio_file]
+        if audio_length is None:
+            continue  # 標頭讀取失敗的音檔（manifest 建立時已提示）
+        data.append((audio_file, transcript, audio_length, lang))
     
     return data
 
-all_data = {lang: load_transcripts(path, lang) for lang, path in languages.items()}
+class DurationIndex:
+    """ 單一語言依長度排序的音檔陣列，以 bisect 在 O(log N) 內找出長度不超過剩餘額度的音檔 """
 
-# 配置切換次數和測試集大小
-switch_counts = {2: 16000, 3: 8000}
-base_max_length = 25000  # 25 秒
+    def __init__(self, data):
+        self.data = sorted(data, key=lambda d: (d[2], d[0]))
+        self.durations = [d[2] for d in self.data]
 
-# 組合測試集
-test_audio_list = []
-test_transcripts = []
-language_statistics = defaultdict(lambda: defaultdict(int))
-used_audio_files = {switch_count: [] for switch_count in switch_counts.keys()}  # 記錄使用的音檔
-
-for switch_count, num_samples in switch_counts.items():
-    max_combined_length = base_max_length - (switch_count - 2) * 5000  # 讓 4-switch 更短
-    for _ in range(num_samples):
-        combined_audio = AudioSegment.empty()
-        combined_transcript = []
-        current_length = 0
-        language_durations = defaultdict(int)
-        used_files = []  # 記錄當次合併的音檔
+    def __len__(self):
+        return len(self.data)
+
+    def sample(self, rng, max_length):
+        """ 在長度 <= max_length 的音檔中均勻抽一個，沒有符合的則回傳 None """
+        count = bisect.bisect_right(self.durations, max_length)
+        if count == 0:
+            return None
+        return self.data[rng.randrange(count)]
+
+def decode_audio(audio_file, sample_rate=output_sample_rate):
+    """ 解碼成單聲道 int16 NumPy 陣列；已是目標格式的 PCM WAV 直接讀取，其餘交給 pydub 轉換 """
+    try:
+        with wave.open(audio_file, "rb") as w:
+            if w.getnchannels() == 1 and w.getsampwidth() == 2 and w.getframerate() == sample_rate:
+                return np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.int16, copy=False)
+    except (wave.Error, EOFError):
+        pass
+    segment = AudioSegment.from_file(audio_file).set_frame_rate(sample_rate).set_channels(1).set_sample_width(2)
+    return np.frombuffer(segment.raw_data, dtype="<i2").astype(np.int16, copy=False)
+
+class AudioCache:
+    """ 以 LRU 淘汰、總大小不超過 max_bytes 的已解碼音檔快取，重複抽到的音檔不必再解碼 """
+
+    def __init__(self, max_bytes=audio_cache_mb * 1024 ** 2, sample_rate=output_sample_rate):
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, audio_file):
+        samples = self.entries.get(audio_file)
+        if samples is not None:
+            self.entries.move_to_end(audio_file)
+            self.hits += 1
+            return samples
+
+        self.misses += 1
+        samples = decode_audio(audio_file, self.sample_rate)
+        if samples.nbytes <= self.max_bytes:
+            self.entries[audio_file] = samples
+            self.total_bytes += samples.nbytes
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+        return samples
+
+def concat_into(buffer, clips):
+    """ 將多段音訊依序複製進預先配置的 int16 buffer（不足時才擴大），回傳 (buffer, 合併後的 view) """
+    total = sum(len(clip) for clip in clips)
+    if total > len(buffer):
+        buffer = np.empty(total, dtype=np.int16)
+    offset = 0
+    for clip in clips:
+        buffer[offset:offset + len(clip)] = clip
+        offset += len(clip)
+    return buffer, buffer[:total]
+
+def write_wav(output_file, samples, sample_rate=output_sample_rate):
+    with wave.open(output_file, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.astype("<i2", copy=False).tobytes())
+
+def max_length_for(switch_count):
+    return base_max_length - (switch_count - 2) * 5000  # 讓 4-switch 更短
+
+def build_indexes(all_data):
+    indexes = {lang: DurationIndex(data) for lang, data in all_data.items()}
+    # 確保語言有音檔
+    available_languages = [lang for lang in indexes if indexes[lang]]
+    return indexes, available_languages
+
+def pick_clips(rng, indexes, available_languages, switch_count, max_combined_length):
+    """ 隨機決定語言順序，每個語言抽一個不超過剩餘長度的音檔，回傳 [(audio_file, transcript, audio_length, lang), ...] """
+    picks = []
+    current_length = 0
+    num_languages = min(switch_count, len(available_languages))  # 避免超過可用語言數
+
+    # 隨機決定語言順序
+    selected_languages = rng.sample(available_languages, num_languages)
+
+    for lang in selected_languages:
+        candidate = indexes[lang].sample(rng, max_combined_length - current_length)
 
-        # 確保語言有音檔
-        available_languages = [lang for lang in all_data.keys() if all_data[lang]]
-        num_languages = min(switch_count, len(available_languages))  # 避免超過可用語言數
+        if candidate is None:
+            continue  # 如果沒有符合條件的音檔，就跳過這次選擇
 
-        # 隨機決定語言順序
-        selected_languages = random.sample(available_languages, num_languages)
+        picks.append(candidate)
+        current_length += candidate[2]
 
-        for lang in selected_languages:
-            candidates = [d for d in all_data[lang] if d[2] + current_length <= max_combined_length]
+        if current_length >= max_combined_length:
+            break
+    return picks
 
-            if not candidates:
-                continue  # 如果沒有符合條件的音檔，就跳過這次選擇
-            
-            audio_file, transcript, audio_length, lang = random.choice(candidates)
-            audio_segment = AudioSegment.from_file(audio_file)
+def sample_switch_counts():
+    """ 依 switch_counts 展開全部樣本，第 k 個元素為樣本 k 的切換次數 """
+    return [switch_count for switch_count, num_samples in switch_counts.items() for _ in range(num_samples)]
 
-            combined_audio += audio_segment
-            combined_transcript.append(transcript)
-            current_length += audio_length
+def shard_path(shard_index, num_shards):
+    return f"{output_transcript_file}.shard{shard_index}-of-{num_shards}.jsonl"
+
+# 每個 worker 行程各自的語料索引、音檔快取與輸出 buffer
+_worker_state = None
+
+def init_worker(all_data, cache_bytes=audio_cache_mb * 1024 ** 2):
+    global _worker_state
+    indexes, available_languages = build_indexes(all_data)
+    buffer = np.empty(base_max_length * output_sample_rate // 1000, dtype=np.int16)
+    _worker_state = {"indexes": indexes, "languages": available_languages, "cache": AudioCache(cache_bytes), "buffer": buffer}
+
+def generate_samples(sample_jobs):
+    """ 合成一批 (k, switch_count) 樣本並寫出音檔，回傳可寫入 shard JSONL 的紀錄 """
+    state = _worker_state
+    records = []
+    for k, switch_count in sample_jobs:
+        rng = random.Random(f"{seed}:{k}")
+        picks = pick_clips(rng, state["indexes"], state["languages"], switch_count, max_length_for(switch_count))
+        if not picks:
+            continue
+
+        output_audio_file = os.path.join(output_audio_folder, f"combined_{k + 1}.wav")
+        state["buffer"], combined_audio = concat_into(state["buffer"], [state["cache"].get(audio_file) for audio_file, _, _, _ in picks])
+        write_wav(output_audio_file, combined_audio)
+        records.append({
+            "index": k,
+            "switch_count": switch_count,
+            "audio_file": output_audio_file,
+            "transcript": " ".join(transcript for _, transcript, _, _ in picks),
+            "used_files": [(audio_file, lang, audio_length) for audio_file, _, audio_length, lang in picks],
+        })
+    return records
+
+# 組合測試集（第 shard_index 個分片：樣本 k % num_shards == shard_index）
+def generate_shard(all_data, shard_index=0, num_shards=1, workers=1, chunk_size=64):
+    jobs = [(k, switch_count) for k, switch_count in enumerate(sample_switch_counts()) if k % num_shards == shard_index]
+    chunks = [jobs[start:start + chunk_size] for start in range(0, len(jobs), chunk_size)]
+
+    count = 0
+    with open(shard_path(shard_index, num_shards), 'w', encoding='utf-8') as f:
+        if workers > 1:
+            # 快取上限由各 worker 平分，總記憶體不隨行程數增加
+            cache_bytes = audio_cache_mb * 1024 ** 2 // workers
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(all_data, cache_bytes)) as pool:
+                results = pool.imap(generate_samples, chunks)
+                for records in results:
+                    for record in records:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    count += len(records)
+        else:
+            init_worker(all_data)
+            for chunk in chunks:
+                records = generate_samples(chunk)
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += len(records)
+    print(f"分片 {shard_index}/{num_shards} 完成：{count} 個混合音檔")
+
+def merge_shards(num_shards):
+    """ 依樣本編號合併各分片，輸出與分片數無關（byte-identical） """
+    records = []
+    for shard_index in range(num_shards):
+        with open(shard_path(shard_index, num_shards), 'r', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record["index"])
+
+    test_audio_list = [record["audio_file"] for record in records]
+    test_transcripts = [record["transcript"] for record in records]
+    language_statistics = defaultdict(lambda: defaultdict(int))
+    used_audio_files = {switch_count: [] for switch_count in switch_counts.keys()}  # 記錄使用的音檔
+
+    for record in records:
+        # 記錄使用過的音檔
+        used_files = [tuple(used) for used in record["used_files"]]
+        used_audio_files[record["switch_count"]].extend(used_files)
+
+        # 更新語言統計
+        current_length = sum(audio_length for _, _, audio_length in used_files)
+        language_durations = defaultdict(int)
+        for _, lang, audio_length in used_files:
             language_durations[lang] += audio_length
-            used_files.append((audio_file, lang, audio_length))  # 記錄音檔
-            
-            if current_length >= max_combined_length:
-                break
-        
-        if current_length <= max_combined_length and used_files:
-            output_audio_file = os.path.join(output_audio_folder, f"combined_{len(test_audio_list) + 1}.wav")
-            combined_audio.export(output_audio_file, format="wav")
-            test_audio_list.append(output_audio_file)
-            test_transcripts.append(" ".join(combined_transcript))
-
-            # 記錄使用過的音檔
-            used_audio_files[switch_count].extend(used_files)
-
-            # 更新語言統計
-            for lang, duration in language_durations.items():
-                proportion = duration / current_length
-                language_statistics[lang]["count"] += 1
-                language_statistics[lang]["duration"] += duration
-                language_statistics[lang]["proportion"] += proportion
-
-# 儲存測試集的轉錄文本
-with open(output_transcript_file, 'w', encoding='utf-8') as f:
-    for audio_file, transcript in zip(test_audio_list, test_transcripts):
-        f.write(f"{audio_file} {transcript}\n")
-
-# 儲存使用過的音檔名稱
-for switch_count, files in used_audio_files.items():
-    used_files_path = os.path.join(output_audio_folder, f"used_files_switch_{switch_count}.txt")
-    with open(used_files_path, 'w', encoding='utf-8') as f:
-        for file, lang, duration in files:
-            f.write(f"{file} ({lang_tags[lang]}, {duration}ms)\n")
-
-# 輸出統計結果
-print("\n合併比例統計：")
-for lang, stats in language_statistics.items():
-    avg_proportion = stats["avg_proportion"]
-    total_duration = stats["duration"] / 1000  # 轉為秒
-    print(f"語言: {lang}")
-    print(f"  平均占比: {avg_proportion:.2%}")
-    print(f"  總時長: {total_duration:.2f} 秒")
-    print(f"  參與合併段數: {stats['count']}")
-
-print(f"混合音檔已儲存至 {output_transcript_file}")
-print(f"使用的音檔名稱已儲存至 {output_audio_folder}/used_files_switch_*.txt")
+        for lang, duration in language_durations.items():
+            proportion = duration / current_length
+            language_statistics[lang]["count"] += 1
+            language_statistics[lang]["duration"] += duration
+            language_statistics[lang]["proportion"] += proportion
+
+    write_outputs(test_audio_list, test_transcripts, language_statistics, used_audio_files)
+
+def write_outputs(test_audio_list, test_transcripts, language_statistics, used_audio_files):
+    # 儲存測試集的轉錄文本
+    with open(output_transcript_file, 'w', encoding='utf-8') as f:
+        for audio_file, transcript in zip(test_audio_list, test_transcripts):
+            f.write(f"{audio_file} {transcript}\n")
+
+    # 儲存使用過的音檔名稱
+    for switch_count, files in used_audio_files.items():
+        used_files_path = os.path.join(output_audio_folder, f"used_files_switch_{switch_count}.txt")
+        with open(used_files_path, 'w', encoding='utf-8') as f:
+            for file, lang, duration in files:
+                f.write(f"{file} ({lang_tags[lang]}, {duration}ms)\n")
+
+    # 輸出統計結果
+    print("\n合併比例統計：")
+    for lang, stats in language_statistics.items():
+        avg_proportion = stats["proportion"] / stats["count"]
+        total_duration = stats["duration"] / 1000  # 轉為秒
+        print(f"語言: {lang}")
+        print(f"  平均占比: {avg_proportion:.2%}")
+        print(f"  總時長: {total_duration:.2f} 秒")
+        print(f"  參與合併段數: {stats['count']}")
+
+    print(f"混合音檔已儲存至 {output_transcript_file}")
+    print(f"使用的音檔名稱已儲存至 {output_audio_folder}/used_files_switch_*.txt")
+
+def main():
+    parser = argparse.ArgumentParser(description="合成 code-switch 音檔，可分片到多個行程 / 機器")
+    parser.add_argument("--shard", default="0/1", help="i/N：只產生第 i 個分片（共 N 片）")
+    parser.add_argument("--workers", type=int, default=1, help="本分片使用的行程數")
+    parser.add_argument("--merge", type=int, default=0, metavar="N", help="合併 N 個已完成的分片後結束")
+    args = parser.parse_args()
+
+    if args.merge:
+        merge_shards(args.merge)
+        return
+
+    shard_index, num_shards = (int(value) for value in args.shard.split("/"))
+    if not 0 <= shard_index < num_shards:
+        parser.error(f"--shard 需為 i/N 且 0 <= i < N：{args.shard}")
+    os.makedirs(output_audio_folder, exist_ok=True)
+    all_data = {lang: load_transcripts(path, lang) for lang, path in languages.items()}
+    generate_shard(all_data, shard_index, num_shards, args.workers)
+    if num_shards == 1:
+        merge_shards(1)
+    else:
+        print(f"所有分片完成後執行 --merge {num_shards} 合併結果")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+manifest_name = "audio_manifest.json"  # 每個語言資料夾一份，記錄 {相對路徑: [size, mtime_ns, 長度 ms]}
+
+def read_wav_header(audio_file):
+    """ 走訪 RIFF chunk，回傳 (sample_rate, block_align, data 大小)，不讀取音訊內容（PCM / float / extensible 皆適用） """
+    with open(audio_file, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError("not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("missing data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                _, _, sample_rate, _, block_align = struct.unpack("<HHIIH", f.read(14))
+                fmt = (sample_rate, block_align)
+                f.seek(chunk_size - 14 + (chunk_size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("data chunk before fmt chunk")
+                # 串流寫出的檔案 data 大小可能未填（0 / 0xFFFFFFFF），改以檔案大小推算
+                remaining = os.fstat(f.fileno()).st_size - f.tell()
+                if chunk_size in (0, 0xFFFFFFFF) or chunk_size > remaining:
+                    chunk_size = remaining
+                return fmt[0], fmt[1], chunk_size
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)  # chunk 以 2 bytes 對齊
+
+def probe_duration(audio_file):
+    """ 只讀 WAV 標頭取得長度（毫秒，與 len(AudioSegment) 相同）；非 WAV 才退回完整解碼 """
+    try:
+        sample_rate, block_align, data_size = read_wav_header(audio_file)
+    except (ValueError, struct.error):
+        from pydub import AudioSegment
+        return len(AudioSegment.from_file(audio_file))
+    return round(1000 * (data_size // block_align) / sample_rate)
+
+def scan_wav_files(folder):
+    """ 以 os.scandir 遞迴列出 .wav，回傳 {相對路徑: (size, mtime_ns)} """
+    files = {}
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue  # 與 glob 相同，略過隱藏檔案與資料夾
+                if entry.is_dir(follow_symlinks=True):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".wav"):
+                    stat = entry.stat()
+                    files[os.path.relpath(entry.path, folder)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+def _probe(path):
+    try:
+        return probe_duration(path), None
+    except Exception as e:
+        return None, e
+
+def load_manifest(audio_folder, manifest_path=None, num_workers=16):
+    """
+    回傳 {完整路徑: 長度 ms}。沿用上次的 manifest，只重新讀取新增或 size/mtime 改變的音檔，
+    並以多執行緒平行讀取標頭。讀取失敗的音檔長度為 None（同樣會被快取，直到檔案改變）。
+    """
+    manifest_path = manifest_path or os.path.join(audio_folder, manifest_name)
+    cached = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            cached = {}
+
+    files = scan_wav_files(audio_folder)
+    manifest = {}
+    pending = []
+    for rel_path, (size, mtime_ns) in files.items():
+        entry = cached.get(rel_path)
+        if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+            manifest[rel_path] = entry
+        else:
+            pending.append(rel_path)
+
+    if pending:
+        print(f"{audio_folder}：{len(files) - len(pending)} 個音檔沿用 manifest，{len(pending)} 個重新讀取標頭")
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            results = pool.map(_probe, [os.path.join(audio_folder, rel_path) for rel_path in pending])
+            for rel_path, (duration, error) in zip(pending, results):
+                if error is not None:
+                    print(f"音檔加載失敗，跳過：{os.path.join(audio_folder, rel_path)}, 錯誤信息：{error}")
+                manifest[rel_path] = [*files[rel_path], duration]
+
+    if pending or len(manifest) != len(cached):
+        tmp_path = manifest_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            print(f"無法寫入 manifest：{manifest_path}, 錯誤信息：{e}")
+
+    return {os.path.join(audio_folder, rel_path): entry[2] for rel_path, entry in manifest.items()}
@@ -1,56 +1,412 @@
 import os
+import argparse
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
 import torchaudio
+import transformers
 from transformers import AutoProcessor, AutoModelForSpeechSeq2Seq
-from tqdm import tqdm 
+from tqdm import tqdm
+import stage_profiler
+from feature_cache import FeatureCache
+from transcription_cache import TranscriptionCache, collect_finished, model_fingerprint, write_merged_output
+from transcriptions_normalize import normalize_text
 
 model_path = "./whisper-finetuned"
 audio_folder = "./test_audio"
 output_file = "transcriptions.txt"
+normalized_output_file = None  # e.g. "hyp.txt": also write MER-ready normalized transcripts
+batch_size = 8  # Number of clips decoded per generate call (1 = per-file decoding)
+num_workers = 4  # Threads that load audio and extract features ahead of the model
+prefetch_size = 32  # Max clips loaded ahead of the model (bounds memory use)
+feature_cache_dir = "./feature_cache"  # Log-mel cache shared with KTG_train.py (None to disable)
+resume = False  # Reuse finished results from the settings-keyed sidecar cache and only transcribe the rest
+decode_settings = {"language": "zh", "task": "transcribe", "num_beams": 10}
 
-# Load processor
-try:
-    processor = AutoProcessor.from_pretrained(model_path)
-    print("✅ Successfully loaded processor and tokenizer.")
-except:
-    print("⚠️ Tokenizer not found, downloading from original model...")
-    processor = AutoProcessor.from_pretrained("openai/whisper-large-v2")
-    processor.save_pretrained(model_path)
-    print("✅ Tokenizer restored.")
-
-# Load model
+# Long-form mode: energy VAD drops silence and packs speech into <=30 s chunks,
+# so recordings longer than Whisper's window are transcribed in full
+long_form = False
+max_chunk_seconds = 30.0
+vad_frame_ms = 30  # Frame size for energy computation
+vad_threshold_db = -40.0  # Frames quieter than (loudest frame + threshold) are silence
+vad_min_silence_ms = 300  # Shorter pauses are kept inside a speech region
+vad_pad_ms = 100  # Context kept around each speech region
+
+# "int8" applies dynamic int8 quantization to nn.Linear layers when running on CPU;
+# the quantized model is saved next to the weights so later starts skip re-quantizing
+quantize = None
+quantized_artifact_name = "quantized_int8.pt"
+
+# Speculative decoding: the distilled student (k2d) drafts tokens and the teacher
+# verifies them, so the output equals teacher greedy decoding at close to student cost
+assistant_model_path = None
+
+# Opt-in per-stage profiling: writes <profile_output>.jsonl (per file + summary) and
+# <profile_output>.trace.json (Chrome trace). None disables it.
+profile_output = None
+
+# Model state is loaded on demand (see load_model / set_model) so that importing
+# this module, e.g. from KTG_server.py, does not pay the model loading cost
 device = "cuda" if torch.cuda.is_available() else "cpu"
-model = AutoModelForSpeechSeq2Seq.from_pretrained(model_path).to(device)
-model.eval()
+processor = None
+model = None
+assistant_model = None
+feature_cache = None
+# What produced the loaded model, for the resume cache key (None after set_model)
+loaded_model_settings = None
 
-def transcribe(audio_path):
+def set_model(new_model, new_processor):
     """
-    Transcribe audio file using forced zh decoding.
-    Returns raw transcription (no segmentation).
+    Install an already constructed model/processor pair for transcription.
+    """
+    global model, processor, feature_cache, loaded_model_settings
+    processor = new_processor
+    loaded_model_settings = None
+    model = new_model.to(device)
+    model.eval()
+    feature_cache = FeatureCache(feature_cache_dir, processor.feature_extractor) if feature_cache_dir else None
+
+def load_quantized_model(path):
+    """
+    Return a dynamic-int8 quantized copy of the model at path, reusing the saved
+    artifact when it is newer than the weights and was made by this torch and
+    transformers version. Unreadable artifacts are rebuilt.
+    """
+    artifact_path = os.path.join(path, quantized_artifact_name)
+    tmp_path = artifact_path + ".tmp"
+    weights_mtime = max((os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)
+                         if name not in (quantized_artifact_name, quantized_artifact_name + ".tmp")), default=0)
+    if os.path.exists(artifact_path) and os.path.getmtime(artifact_path) >= weights_mtime:
+        try:
+            artifact = torch.load(artifact_path, weights_only=False)
+            if (artifact.get("torch_version") == torch.__version__
+                    and artifact.get("transformers_version") == transformers.__version__):
+                print(f"✅ Loaded quantized model from `{artifact_path}`.")
+                return artifact["model"]
+        except Exception as e:
+            print(f"⚠️ Could not load quantized model from `{artifact_path}` ({e}), re-quantizing.")
+
+    print("🔄 Quantizing nn.Linear layers to int8...")
+    fp32_model = AutoModelForSpeechSeq2Seq.from_pretrained(path)
+    fp32_model.eval()
+    quantized_model = torch.quantization.quantize_dynamic(fp32_model, {torch.nn.Linear}, dtype=torch.qint8)
+    # Write to a temporary file first so an interrupted save never leaves a partial artifact
+    torch.save({"torch_version": torch.__version__, "transformers_version": transformers.__version__,
+                "model": quantized_model}, tmp_path)
+    os.replace(tmp_path, artifact_path)
+    print(f"✅ Saved quantized model to `{artifact_path}`.")
+    return quantized_model
+
+def load_model(path=model_path, quantize=quantize):
     """
+    Load the fine-tuned processor and model from path.
+    """
+    global loaded_model_settings
+    # Load processor
     try:
+        new_processor = AutoProcessor.from_pretrained(path)
+        print("✅ Successfully loaded processor and tokenizer.")
+    except:
+        print("⚠️ Tokenizer not found, downloading from original model...")
+        new_processor = AutoProcessor.from_pretrained("openai/whisper-large-v2")
+        new_processor.save_pretrained(path)
+        print("✅ Tokenizer restored.")
+
+    # Load model
+    if quantize == "int8" and device == "cpu":
+        set_model(load_quantized_model(path), new_processor)
+    else:
+        if quantize == "int8":
+            print("⚠️ int8 quantization is only applied on CPU, loading full precision model.")
+            quantize = None
+        set_model(AutoModelForSpeechSeq2Seq.from_pretrained(path), new_processor)
+    loaded_model_settings = {"model_path": path, "quantize": quantize, "assistant_model_path": None}
+
+# Resamplers are reused per source sample rate instead of rebuilt for every file
+_resamplers = {}
+_resamplers_lock = threading.Lock()
+
+def get_resampler(sr):
+    """
+    Return a cached sr -> 16 kHz resampler.
+    """
+    with _resamplers_lock:
+        if sr not in _resamplers:
+            _resamplers[sr] = torchaudio.transforms.Resample(sr, 16000)
+        return _resamplers[sr]
+
+def load_audio(audio_path):
+    """
+    Load audio file as a mono 16 kHz numpy array.
+    """
+    with stage_profiler.stage("load_audio", file=audio_path):
         speech_array, sr = torchaudio.load(audio_path)
-        if sr != 16000:
-            resampler = torchaudio.transforms.Resample(sr, 16000)
-            speech_array = resampler(speech_array)
-        speech_array = speech_array.squeeze().numpy()
+    if sr != 16000:
+        with stage_profiler.stage("resample", file=audio_path):
+            speech_array = get_resampler(sr)(speech_array)
+    return speech_array.squeeze().numpy()
+
+def compute_features(audio_path):
+    """
+    Load audio file and compute its log-mel input features (n_mels x 3000).
+    """
+    speech_array = load_audio(audio_path)
+    with stage_profiler.stage("features", file=audio_path):
+        return processor.feature_extractor(speech_array, sampling_rate=16000).input_features[0]
+
+def extract_features(audio_path):
+    """
+    Return input features for audio_path, served from the feature cache when enabled.
+    """
+    if feature_cache is not None:
+        return feature_cache.get_or_compute(audio_path, compute_features)
+    return compute_features(audio_path)
+
+def detect_speech(speech_array, sr=16000):
+    """
+    Energy-based voice activity detection.
+    Returns a list of (start, end) sample ranges that contain speech.
+    """
+    frame = int(sr * vad_frame_ms / 1000)
+    n_frames = -(-len(speech_array) // frame)
+    if n_frames == 0:
+        return []
+    padded = np.zeros(n_frames * frame, dtype=np.float32)
+    padded[:len(speech_array)] = speech_array
+    energy_db = 10 * np.log10(np.mean(padded.reshape(n_frames, frame) ** 2, axis=1) + 1e-10)
+    # Threshold is relative to the loudest frame, with an absolute floor for digital silence
+    voiced = energy_db > max(energy_db.max() + vad_threshold_db, -70.0)
+
+    # Contiguous voiced runs as [start_frame, end_frame)
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_gap = vad_min_silence_ms / vad_frame_ms
+    pad = int(sr * vad_pad_ms / 1000)
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end  # Bridge short pauses
+        else:
+            regions.append([start, end])
+    return [(max(0, start * frame - pad), min(len(speech_array), end * frame + pad)) for start, end in regions]
+
+def split_into_chunks(speech_array, regions, sr=16000):
+    """
+    Concatenate speech regions into chunks of at most max_chunk_seconds,
+    splitting regions that are longer than a chunk on their own.
+    """
+    max_len = int(sr * max_chunk_seconds)
+    chunks, current, current_len = [], [], 0
+    for start, end in regions:
+        while end - start > 0:
+            take = min(end - start, max_len - current_len)
+            if take <= 0:
+                chunks.append(np.concatenate(current))
+                current, current_len = [], 0
+                continue
+            current.append(speech_array[start:start + take])
+            current_len += take
+            start += take
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
+
+def extract_chunk_features(audio_path):
+    """
+    Return the list of input features to decode for audio_path:
+    one per VAD chunk in long-form mode, otherwise the single 30 s window.
+    """
+    if not long_form:
+        return [extract_features(audio_path)]
+    speech_array = load_audio(audio_path)
+    with stage_profiler.stage("vad", file=audio_path):
+        chunks = split_into_chunks(speech_array, detect_speech(speech_array))
+    if not chunks:
+        return []
+    with stage_profiler.stage("features", file=audio_path):
+        return list(processor.feature_extractor(chunks, sampling_rate=16000).input_features)
+
+def get_duration(audio_path):
+    """
+    Read audio duration (seconds) from the file header without decoding.
+    Unreadable files return 0 so they are still attempted (and reported) later.
+    """
+    try:
+        info = torchaudio.info(audio_path)
+        return info.num_frames / info.sample_rate
+    except Exception:
+        return 0.0
+
+class SpeculativeStats:
+    """
+    Counts decoder calls of the teacher and the draft model during assisted
+    generation. Every teacher call verifies a run of drafted tokens and emits
+    one token of its own, so accepted drafts = generated tokens - teacher calls.
+    """
+
+    def __init__(self):
+        self.teacher_calls = 0
+        self.draft_calls = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self._handles = []
+
+    def attach(self, teacher, draft):
+        self._handles.append(teacher.get_decoder().register_forward_hook(lambda *_: self._count("teacher_calls")))
+        self._handles.append(draft.get_decoder().register_forward_hook(lambda *_: self._count("draft_calls")))
+
+    def detach(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+
+    def acceptance_rate(self):
+        accepted = max(0, self.tokens - self.teacher_calls)
+        return accepted / self.draft_calls if self.draft_calls else 0.0
+
+    def summary(self):
+        tokens_per_call = self.tokens / self.teacher_calls if self.teacher_calls else 0.0
+        return (f"acceptance rate ≈ {self.acceptance_rate():.2%}, {tokens_per_call:.2f} tokens per teacher call, "
+                f"{self.tokens / max(self.seconds, 1e-9):.1f} tokens/s")
 
-        input_features = processor.feature_extractor(speech_array, sampling_rate=16000).input_features
-        input_features = torch.tensor(input_features).to(device)
+speculative_stats = SpeculativeStats()
 
-        forced_decoder_ids = processor.get_decoder_prompt_ids(language="zh", task="transcribe")
+def load_assistant_model(path):
+    """
+    Load the draft (student) model used for speculative decoding.
+    It must share the teacher's tokenizer.
+    """
+    global assistant_model
+    speculative_stats.detach()
+    if loaded_model_settings is not None:
+        loaded_model_settings["assistant_model_path"] = os.path.abspath(path)
+    assistant_model = AutoModelForSpeechSeq2Seq.from_pretrained(path).to(device)
+    assistant_model.eval()
+    speculative_stats.attach(model, assistant_model)
+    print(f"✅ Loaded draft model for speculative decoding from `{path}`.")
+
+def count_generated_tokens(predicted_ids, forced_decoder_ids):
+    """
+    Number of tokens produced by decoding steps, i.e. excluding the forced prompt.
+    """
+    if predicted_ids[0].item() == model.generation_config.decoder_start_token_id:
+        return len(predicted_ids) - 1 - len(forced_decoder_ids)
+    return len(predicted_ids)
+
+def count_batch_tokens(predicted_ids, forced_decoder_ids):
+    """
+    Generated (non-prompt, non-padding) tokens of each row of a generate() output.
+    """
+    prompt_len = 1 + len(forced_decoder_ids) if predicted_ids[0, 0].item() == model.generation_config.decoder_start_token_id else 0
+    return (predicted_ids[:, prompt_len:] != model.generation_config.pad_token_id).sum(dim=1).tolist()
+
+def decode_features(features, use_assistant=True, audio_paths=None):
+    """
+    Run generation on a list of input feature arrays and return the transcriptions.
+    With a draft model loaded, clips are decoded greedily one at a time with
+    assisted generation (identical output to teacher greedy decoding).
+    audio_paths only labels the profiling stages.
+    """
+    audio_paths = list(audio_paths) if audio_paths else [None] * len(features)  # Callers reuse their lists
+    forced_decoder_ids = processor.get_decoder_prompt_ids(language=decode_settings["language"], task=decode_settings["task"])
+
+    if assistant_model is not None and use_assistant:
+        transcriptions = []
+        for audio_path, input_features in zip(audio_paths, features):
+            input_features = torch.tensor(input_features[None]).to(device)
+            start = time.perf_counter()
+            with stage_profiler.stage("generate", files=[audio_path]) as stage_args, torch.no_grad():
+                predicted_ids = model.generate(input_features, forced_decoder_ids=forced_decoder_ids,
+                                               assistant_model=assistant_model, num_beams=1, do_sample=False)
+                stage_args["tokens"] = [count_generated_tokens(predicted_ids[0], forced_decoder_ids)]
+            speculative_stats.seconds += time.perf_counter() - start
+            speculative_stats.tokens += stage_args["tokens"][0]
+            with stage_profiler.stage("batch_decode", files=[audio_path]):
+                transcriptions.extend(processor.tokenizer.batch_decode(predicted_ids, skip_special_tokens=True))
+        return transcriptions
+
+    input_features = torch.tensor(np.stack(features)).to(device)
 
-        with torch.no_grad():
-            predicted_ids = model.generate(input_features, forced_decoder_ids=forced_decoder_ids, num_beams=10)
+    num_beams = 1 if assistant_model is not None else decode_settings["num_beams"]
+    with stage_profiler.stage("generate", files=audio_paths) as stage_args, torch.no_grad():
+        predicted_ids = model.generate(input_features, forced_decoder_ids=forced_decoder_ids, num_beams=num_beams)
+        if stage_profiler.active() is not None:
+            stage_args["tokens"] = count_batch_tokens(predicted_ids, forced_decoder_ids)
 
-        transcription = processor.tokenizer.batch_decode(predicted_ids, skip_special_tokens=True)[0]
-        return transcription
+    with stage_profiler.stage("batch_decode", files=audio_paths):
+        return processor.tokenizer.batch_decode(predicted_ids, skip_special_tokens=True)
+
+def transcribe(audio_path):
+    """
+    Transcribe audio file using forced zh decoding.
+    Returns raw transcription (no segmentation).
+    """
+    try:
+        chunk_features = extract_chunk_features(audio_path)
+        if not chunk_features:
+            return ""
+        return " ".join(decode_features(chunk_features))
 
     except Exception as e:
         print(f"❌ Failed to transcribe: {audio_path} | Error: {e}")
         return None
 
-def transcribe_folder(root_folder, output_path):
+def prefetch_features(audio_paths, num_workers=num_workers, prefetch_size=prefetch_size):
+    """
+    Yield (audio_path, chunk_features) in input order while a worker pool loads,
+    resamples and extracts features for the upcoming files.
+    At most prefetch_size files are in flight; failed files yield None.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        pending = deque()
+        paths = iter(audio_paths)
+
+        def submit_next():
+            audio_path = next(paths, None)
+            if audio_path is not None:
+                pending.append((audio_path, executor.submit(extract_chunk_features, audio_path)))
+
+        for _ in range(max(1, prefetch_size)):
+            submit_next()
+
+        while pending:
+            audio_path, future = pending.popleft()
+            submit_next()
+            try:
+                yield audio_path, future.result()
+            except Exception as e:
+                print(f"❌ Failed to transcribe: {audio_path} | Error: {e}")
+                yield audio_path, None
+
+def transcribe_batch(audio_paths, features):
+    """
+    Transcribe several preloaded clips with a single generate call.
+    Returns a list aligned with audio_paths; failed files are None.
+    """
+    try:
+        return decode_features(features, audio_paths=audio_paths)
+    except Exception as e:
+        # One bad clip should not cost the whole batch: retry file by file
+        print(f"⚠️ Batch decoding failed ({e}), retrying files individually...")
+        results = []
+        for audio_path, input_features in zip(audio_paths, features):
+            try:
+                results.append(decode_features([input_features], audio_paths=[audio_path])[0])
+            except Exception as e:
+                print(f"❌ Failed to transcribe: {audio_path} | Error: {e}")
+                results.append(None)
+        return results
+
+def transcribe_folder(root_folder, output_path, batch_size=batch_size, num_workers=num_workers, resume=resume,
+                      normalized_path=normalized_output_file):
     all_audio_files = []
 
     # Find all .wav files recursively
@@ -62,17 +418,194 @@ def transcribe_folder(root_folder, output_path):
     if not all_audio_files:
         print("⚠️ No .wav files found in folder.")
         return
+    all_audio_files.sort()  # os.walk order is filesystem dependent; keep output deterministic
+
+    transcriptions = {}
+    pending_files = all_audio_files
+    cache = None
+    if resume and loaded_model_settings is None:
+        print("⚠️ Resume needs a model loaded with load_model(); transcribing all files.")
+    elif resume:
+        # Reuse results from a previous (possibly interrupted) run of the same model and settings
+        settings = {**decode_settings, "long_form": long_form,
+                    "quantize": loaded_model_settings["quantize"],
+                    "assistant_model_path": loaded_model_settings["assistant_model_path"]}
+        if assistant_model is not None:
+            settings["num_beams"] = 1  # Speculative decoding reproduces teacher greedy output
+            settings["assistant_model_files"] = model_fingerprint(loaded_model_settings["assistant_model_path"])
+        cache = TranscriptionCache(output_path + ".cache.jsonl", loaded_model_settings["model_path"], settings)
+        transcriptions, pending_files = collect_finished(all_audio_files, cache)
+        print(f"♻️ Resuming: {len(all_audio_files) - len(pending_files)} files already transcribed.")
+
+    print(f"🔄 Starting transcription for {len(pending_files)} audio files...\n")
 
-    print(f"🔄 Starting transcription for {len(all_audio_files)} audio files...\n")
+    profiler = stage_profiler.active()
+    batch_size = max(1, batch_size)
+    durations = {audio_path: get_duration(audio_path) for audio_path in pending_files} if batch_size > 1 or profiler else {}
+    if profiler is not None:
+        for audio_path, duration in durations.items():
+            profiler.set_file_info(audio_path, audio_seconds=duration)
+    if batch_size > 1:
+        # Sort by duration (longest first) so each batch holds clips of similar length
+        decode_order = sorted(pending_files, key=durations.get, reverse=True)
+    else:
+        decode_order = pending_files
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        for audio_path in tqdm(all_audio_files, desc="Processing"):
-            transcription = transcribe(audio_path)
-            if transcription:
-                # Use full path as key
-                f.write(f"{audio_path} {transcription}\n")
+    # A file may span several chunks (long-form mode); its text is stitched
+    # together once every chunk has been decoded
+    chunk_texts = {}
+    remaining_chunks = {}
+    batch_paths, batch_chunks, batch_features = [], [], []
+
+    def finish_file(audio_path):
+        texts = [text for text in chunk_texts.pop(audio_path) if text]
+        transcription = " ".join(texts)
+        transcriptions[audio_path] = transcription
+        if cache is not None and transcription:
+            cache.add(audio_path, transcription)
+
+    def flush_batch():
+        results = transcribe_batch(batch_paths, batch_features)
+        for audio_path, chunk_index, transcription in zip(batch_paths, batch_chunks, results):
+            chunk_texts[audio_path][chunk_index] = transcription
+            remaining_chunks[audio_path] -= 1
+            if remaining_chunks[audio_path] == 0:
+                del remaining_chunks[audio_path]
+                finish_file(audio_path)
+        batch_paths.clear()
+        batch_chunks.clear()
+        batch_features.clear()
+
+    # Audio loading / feature extraction runs in the pool while the model decodes
+    for audio_path, chunk_features in tqdm(prefetch_features(decode_order, num_workers),
+                                           total=len(decode_order), desc="Processing"):
+        if chunk_features is None:
+            continue
+        chunk_texts[audio_path] = [None] * len(chunk_features)
+        if not chunk_features:
+            finish_file(audio_path)  # No speech detected
+            continue
+        remaining_chunks[audio_path] = len(chunk_features)
+        for chunk_index, input_features in enumerate(chunk_features):
+            batch_paths.append(audio_path)
+            batch_chunks.append(chunk_index)
+            batch_features.append(input_features)
+            if len(batch_paths) >= batch_size:
+                flush_batch()
+    if batch_paths:
+        flush_batch()
+    if cache is not None:
+        cache.close()
+
+    # Write results back in the original file order (full path as key)
+    write_merged_output(output_path, all_audio_files, transcriptions)
+    if normalized_path:
+        write_merged_output(normalized_path, all_audio_files, transcriptions, normalize=normalize_text)
 
     print(f"✅ Transcription complete. Results saved to `{output_path}`")
 
+def report_quantization_accuracy(audio_paths, path=model_path):
+    """
+    Transcribe audio_paths with the loaded (quantized) model and with the full
+    precision model, and print the transcript difference and speed of each.
+    """
+    import jiwer
+
+    global loaded_model_settings
+    quantized_model = model
+    start = time.perf_counter()
+    quantized_texts = [transcribe(audio_path) or "" for audio_path in audio_paths]
+    quantized_time = time.perf_counter() - start
+
+    quantized_settings = loaded_model_settings
+    set_model(AutoModelForSpeechSeq2Seq.from_pretrained(path), processor)
+    start = time.perf_counter()
+    fp32_texts = [transcribe(audio_path) or "" for audio_path in audio_paths]
+    fp32_time = time.perf_counter() - start
+    set_model(quantized_model, processor)
+    loaded_model_settings = quantized_settings
+
+    pairs = [(ref, hyp) for ref, hyp in zip(fp32_texts, quantized_texts) if ref]
+    cer = jiwer.cer([ref for ref, _ in pairs], [hyp for _, hyp in pairs]) if pairs else 0.0
+    exact = sum(ref == hyp for ref, hyp in zip(fp32_texts, quantized_texts))
+    print("=== int8 vs fp32 ===")
+    print(f"   Files: {len(audio_paths)}")
+    print(f"   Identical transcripts: {exact}/{len(audio_paths)}")
+    print(f"   CER (int8 vs fp32): {cer:.4f}")
+    print(f"   fp32 time: {fp32_time:.2f}s | int8 time: {quantized_time:.2f}s | speedup: {fp32_time / max(quantized_time, 1e-9):.2f}x")
+
+def benchmark_speculative(audio_paths):
+    """
+    Decode audio_paths with teacher greedy decoding and with speculative decoding,
+    check that the outputs match, and print the speedup and acceptance statistics.
+    """
+    features = []
+    for audio_path in audio_paths:
+        try:
+            features.append(extract_features(audio_path))
+        except Exception as e:
+            print(f"❌ Failed to transcribe: {audio_path} | Error: {e}")
+
+    start = time.perf_counter()
+    greedy_texts = [decode_features([input_features], use_assistant=False)[0] for input_features in features]
+    greedy_time = time.perf_counter() - start
+
+    for name in ("teacher_calls", "draft_calls", "tokens", "seconds"):
+        setattr(speculative_stats, name, 0)
+    start = time.perf_counter()
+    assisted_texts = decode_features(features)
+    assisted_time = time.perf_counter() - start
+
+    mismatches = sum(greedy != assisted for greedy, assisted in zip(greedy_texts, assisted_texts))
+    print("=== Speculative decoding vs teacher greedy ===")
+    print(f"   Files: {len(features)} | Mismatched transcripts: {mismatches}")
+    print(f"   Greedy time: {greedy_time:.2f}s | Speculative time: {assisted_time:.2f}s | speedup: {greedy_time / max(assisted_time, 1e-9):.2f}x")
+    print(f"   {speculative_stats.summary()}")
+
+def main():
+    global long_form
+    parser = argparse.ArgumentParser(description="Transcribe a folder of .wav files with the fine-tuned Whisper model.")
+    parser.add_argument("--model-path", default=model_path)
+    parser.add_argument("--audio-folder", default=audio_folder)
+    parser.add_argument("--output", default=output_file)
+    parser.add_argument("--normalized-output", default=normalized_output_file,
+                        help="Also write normalized transcripts (e.g. hyp.txt for MER.py)")
+    parser.add_argument("--batch-size", type=int, default=batch_size)
+    parser.add_argument("--num-workers", type=int, default=num_workers)
+    parser.add_argument("--quantize", choices=["int8"], default=quantize, help="Dynamic int8 quantization (CPU only)")
+    parser.add_argument("--long-form", action="store_true", default=long_form, help="VAD-chunked transcription of recordings longer than 30 s")
+    parser.add_argument("--resume", action="store_true", default=resume,
+                        help="Skip files already transcribed by this model with these settings (sidecar cache)")
+    parser.add_argument("--report-accuracy", type=int, default=0, metavar="N",
+                        help="Compare quantized and fp32 transcripts on the first N files")
+    parser.add_argument("--assistant-model-path", default=assistant_model_path,
+                        help="Distilled student used as draft model for speculative decoding")
+    parser.add_argument("--benchmark-speculative", type=int, default=0, metavar="N",
+                        help="Compare speculative and teacher greedy decoding on the first N files")
+    parser.add_argument("--profile", default=profile_output, metavar="PREFIX",
+                        help="Record per-stage timings to PREFIX.jsonl and PREFIX.trace.json")
+    args = parser.parse_args()
+
+    long_form = args.long_form
+    load_model(args.model_path, args.quantize)
+    if args.assistant_model_path:
+        load_assistant_model(args.assistant_model_path)
+    profiler = stage_profiler.enable() if args.profile else None
+    transcribe_folder(args.audio_folder, args.output, args.batch_size, args.num_workers, args.resume,
+                      args.normalized_output)
+    if profiler is not None:
+        profiler.export(args.profile)
+    if assistant_model is not None:
+        print(f"📊 Speculative decoding: {speculative_stats.summary()}")
+
+    if args.report_accuracy and args.quantize:
+        audio_paths = sorted(os.path.join(root, file) for root, _, files in os.walk(args.audio_folder)
+                             for file in files if file.endswith(".wav"))
+        report_quantization_accuracy(audio_paths[:args.report_accuracy], args.model_path)
+    if args.benchmark_speculative and assistant_model is not None:
+        audio_paths = sorted(os.path.join(root, file) for root, _, files in os.walk(args.audio_folder)
+                             for file in files if file.endswith(".wav"))
+        benchmark_speculative(audio_paths[:args.benchmark_speculative])
+
 if __name__ == "__main__":
-    transcribe_folder(audio_folder, output_file)
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+import KTG_inference
+from tiny_whisper import build_tiny_random_model
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches of at most max_batch_size,
+    waiting at most max_wait_ms after the first request of a batch.
+    Decoding runs on a single background thread so the event loop stays free.
+    """
+
+    def __init__(self, max_batch_size=8, max_wait_ms=20, stats_window=1000):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.latencies = deque(maxlen=stats_window)
+        self.batch_sizes = deque(maxlen=stats_window)
+        self.num_requests = 0
+        self.num_errors = 0
+        self._decoder = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, input_features):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((input_features, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            features = [input_features for input_features, _, _ in batch]
+            try:
+                texts = await loop.run_in_executor(self._decoder, KTG_inference.decode_features, features)
+            except Exception as e:
+                self.num_errors += len(batch)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self.batch_sizes.append(len(batch))
+            for (_, future, enqueued), text in zip(batch, texts):
+                self.latencies.append(now - enqueued)
+                self.num_requests += 1
+                if not future.done():
+                    future.set_result(text)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "requests": self.num_requests,
+            "errors": self.num_errors,
+            "avg_batch_size": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            "latency_ms": {f"p{q}": percentile(latencies, q) * 1000 for q in (50, 90, 99)},
+        }
+
+def resolve_audio_path(path, audio_root):
+    """
+    Resolve a client supplied path, refusing anything outside audio_root
+    (including via symlinks or ".."). Path requests are disabled without an audio_root.
+    """
+    if audio_root is None:
+        raise PermissionError("path requests are disabled (start the server with --audio-root)")
+    root = os.path.realpath(audio_root)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        raise PermissionError(f"path is outside the audio root: {path}")
+    return full_path
+
+def features_from_request(body, content_type, audio_root=None):
+    """
+    Load audio from an uploaded file body or a JSON {"path": ...} under audio_root and return its input features.
+    """
+    if content_type == "application/json":
+        return KTG_inference.extract_features(resolve_audio_path(json.loads(body)["path"], audio_root))
+    speech_array = KTG_inference.load_audio(io.BytesIO(body))
+    return KTG_inference.processor.feature_extractor(speech_array, sampling_rate=16000).input_features[0]
+
+def create_app(batcher, preprocess_workers=4, audio_root=None):
+    preprocess = ThreadPoolExecutor(max_workers=preprocess_workers)
+
+    async def transcribe_handler(request):
+        body = await request.read()
+        loop = asyncio.get_running_loop()
+        try:
+            input_features = await loop.run_in_executor(preprocess, features_from_request, body,
+                                                        request.content_type, audio_root)
+        except PermissionError as e:
+            return web.json_response({"error": str(e)}, status=403)
+        except Exception as e:
+            return web.json_response({"error": f"Failed to load audio: {e}"}, status=400)
+        try:
+            text = await batcher.submit(input_features)
+        except Exception as e:
+            return web.json_response({"error": f"Failed to transcribe: {e}"}, status=500)
+        return web.json_response({"text": text})
+
+    async def stats_handler(request):
+        return web.json_response(batcher.stats())
+
+    async def start_batcher(app):
+        app["batcher_task"] = asyncio.create_task(batcher.run())
+
+    async def stop_batcher(app):
+        app["batcher_task"].cancel()
+
+    app = web.Application(client_max_size=256 * 1024 ** 2)
+    app.router.add_post("/transcribe", transcribe_handler)
+    app.router.add_get("/stats", stats_handler)
+    app.on_startup.append(start_batcher)
+    app.on_cleanup.append(stop_batcher)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident Whisper transcription server with micro-batching.")
+    parser.add_argument("--model-path", default=KTG_inference.model_path)
+    parser.add_argument("--tiny-random", action="store_true", help="Serve a tiny randomly initialised Whisper (for local testing)")
+    parser.add_argument("--host", default="127.0.0.1", help="Use 0.0.0.0 to accept connections from other machines")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20, help="Latency window used to fill a micro-batch")
+    parser.add_argument("--audio-root", default=None,
+                        help='Allow JSON {"path": ...} requests for files under this folder (disabled by default)')
+    args = parser.parse_args()
+
+    if args.tiny_random:
+        KTG_inference.feature_cache_dir = None
+        KTG_inference.set_model(*build_tiny_random_model())
+    else:
+        KTG_inference.load_model(args.model_path)
+
+    batcher = MicroBatcher(args.max_batch_size, args.max_wait_ms)
+    print(f"✅ Model loaded. Serving on http://{args.host}:{args.port} (POST /transcribe, GET /stats)")
+    web.run_app(create_app(batcher, audio_root=args.audio_root), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
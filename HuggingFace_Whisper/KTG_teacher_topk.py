@@ -0,0 +1,102 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from datasets import load_dataset
+from torch.nn.utils.rnn import pad_sequence
+from tqdm import tqdm
+from transformers import AutoModelForSpeechSeq2Seq, WhisperProcessor
+from feature_cache import FeatureCache
+from KTG_inference import load_audio
+from teacher_topk import TeacherTopK, example_key
+
+# Teacher pass for offline knowledge distillation (KTG_train.py, teacher_topk_dir):
+# the teacher is run once, teacher-forced on the training labels, and its top-k
+# log-probabilities per label position are stored for any number of student runs.
+teacher_model_path = "./whisper-finetuned"
+student_model_name = "openai/whisper-large-v2"  # Labels are tokenized exactly as in KTG_train.py
+data_file = "train_format.jsonl"
+output_dir = "./teacher_topk"
+top_k = 16
+batch_size = 8
+num_workers = 4  # Threads loading audio / computing features
+feature_cache_dir = "./feature_cache"
+max_label_length = 448
+flush_every = 50  # Batches between memmap flushes
+
+device = "cuda" if torch.cuda.is_available() else "cpu"
+
+def main():
+    parser = argparse.ArgumentParser(description="Store teacher top-k log-probabilities for offline distillation.")
+    parser.add_argument("--teacher-model-path", default=teacher_model_path)
+    parser.add_argument("--student-model-name", default=student_model_name, help="Tokenizer used for the training labels")
+    parser.add_argument("--data-file", default=data_file)
+    parser.add_argument("--output-dir", default=output_dir)
+    parser.add_argument("--top-k", type=int, default=top_k)
+    parser.add_argument("--batch-size", type=int, default=batch_size)
+    parser.add_argument("--num-workers", type=int, default=num_workers)
+    args = parser.parse_args()
+
+    dataset = load_dataset("json", data_files={"train": args.data_file}, split="train")
+    tokenizer = WhisperProcessor.from_pretrained(args.student_model_name, language="Chinese", task="transcribe").tokenizer
+    teacher_processor = WhisperProcessor.from_pretrained(args.teacher_model_path)
+    if len(teacher_processor.tokenizer) != len(tokenizer):
+        raise ValueError("Teacher and student must share the same tokenizer for top-k distillation")
+
+    paths = dataset["audio_filepath"]
+    labels = tokenizer(dataset["text"], max_length=max_label_length, truncation=True).input_ids
+    store = TeacherTopK.create(
+        args.output_dir,
+        [example_key(path, example_labels) for path, example_labels in zip(paths, labels)],
+        [len(example_labels) for example_labels in labels],
+        args.top_k,
+        {"teacher": os.path.abspath(args.teacher_model_path) if os.path.exists(args.teacher_model_path) else args.teacher_model_path,
+         "tokenizer": args.student_model_name, "max_label_length": max_label_length},
+    )
+    # Similar label lengths per batch keep decoder padding small
+    pending = sorted((row for row in range(len(paths)) if not store.is_done(row)), key=lambda row: len(labels[row]))
+    print(f"✅ {len(paths) - len(pending)} examples already done, {len(pending)} to run through the teacher.")
+    if not pending:
+        return
+
+    teacher = AutoModelForSpeechSeq2Seq.from_pretrained(
+        args.teacher_model_path, torch_dtype=torch.float16 if device == "cuda" else torch.float32).to(device)
+    teacher.eval()
+    feature_extractor = teacher_processor.feature_extractor
+    feature_cache = FeatureCache(feature_cache_dir, feature_extractor) if feature_cache_dir else None
+
+    def compute_features(audio_filepath):
+        if isinstance(audio_filepath, (list, tuple)):
+            speech_array = np.concatenate([load_audio(path) for path in audio_filepath])
+        else:
+            speech_array = load_audio(audio_filepath)
+        return feature_extractor(speech_array, sampling_rate=16000).input_features[0]
+
+    def extract_features(audio_filepath):
+        if feature_cache is not None:
+            return feature_cache.get_or_compute(audio_filepath, compute_features)
+        return compute_features(audio_filepath)
+
+    batches = [pending[start:start + args.batch_size] for start in range(0, len(pending), args.batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, args.num_workers)) as executor:
+        for batch_index, rows in enumerate(tqdm(batches, desc="Teacher pass")):
+            features = list(executor.map(extract_features, [paths[row] for row in rows]))
+            input_features = torch.tensor(np.stack(features), dtype=teacher.dtype).to(device)
+            batch_labels = pad_sequence([torch.tensor(labels[row]) for row in rows], batch_first=True, padding_value=-100).to(device)
+
+            with torch.no_grad():
+                # Passing labels gives the same right-shifted decoder inputs as training
+                logits = teacher(input_features=input_features, labels=batch_labels).logits
+                top = torch.log_softmax(logits.float(), dim=-1).topk(args.top_k, dim=-1)
+            top_ids = top.indices.to(torch.int32).cpu().numpy()
+            top_logprobs = top.values.to(torch.float16).cpu().numpy()
+            for i, row in enumerate(rows):
+                store.write(row, top_ids[i], top_logprobs[i])
+            if (batch_index + 1) % flush_every == 0:
+                store.flush()
+    store.flush()
+    print(f"✅ Teacher top-{args.top_k} log-probabilities saved to `{args.output_dir}`")
+
+if __name__ == "__main__":
+    main()
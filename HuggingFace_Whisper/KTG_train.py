@@ -1,44 +1,231 @@
 import os
 import json
+import numpy as np
 import torch
 import torchaudio
 from torch.nn.utils.rnn import pad_sequence
-from datasets import load_dataset
+from datasets import load_dataset, Dataset, Array2D, Sequence, Value
 from transformers import WhisperProcessor, WhisperForConditionalGeneration, TrainingArguments, Trainer
-
-# 載入資料集
-dataset = load_dataset("json", data_files={"train": "train_format.jsonl"}, split="train")
+from feature_cache import FeatureCache
+from codeswitch_stream import CodeSwitchStream, load_corpus
+from teacher_topk import TeacherTopK
 
 # 載入 Whisper Large 的處理器與模型
 model_name = "openai/whisper-large-v2"
 processor = WhisperProcessor.from_pretrained(model_name, language="Chinese", task="transcribe")
 model = WhisperForConditionalGeneration.from_pretrained(model_name)
 
-def prepare_example(example):
+# log-mel 特徵快取（與 KTG_inference.py 共用，設為 None 則停用）
+feature_cache_dir = "./feature_cache"
+feature_cache = FeatureCache(feature_cache_dir, processor.feature_extractor) if feature_cache_dir else None
+
+# 資料處理模式：
+#   "lazy"       - 訓練時由 DataLoader workers 即時抽取特徵，啟動只需數秒且不寫 Arrow 快取
+#   "precompute" - 以 num_proc 個行程平行預先抽取，特徵以 float16 存入 Arrow 快取
+#   "eager"      - 原本的單行程 dataset.map（float32）
+#   "codeswitch" - 不讀 train_format.jsonl，由 Data_prepare 的三語語料在 DataLoader workers 中即時合成
+#                  code-switch 樣本（每個 epoch、每個 worker 各自設定種子），不需先寫出合併音檔
+data_mode = "lazy"
+num_proc = os.cpu_count()
+dataloader_num_workers = 4
+
+# "codeswitch" 模式：每個 epoch 的合成樣本數；IterableDataset 沒有長度，需以 max_steps 指定訓練步數
+codeswitch_samples_per_epoch = 24000
+codeswitch_max_steps = 6000
+
+# 短句打包：將多個短音檔（音訊與 text）串接成一個 30 秒視窗，減少 padding 的運算
+pack_utterances = False
+pack_separator = " "        # 打包後各段文字之間的分隔符（pack_timestamps 時改放在每段文字前）
+pack_timestamps = False     # 是否在每段前後加入 Whisper 時間戳記 token（<|0.00|> ...）
+max_window_seconds = 30.0
+max_label_tokens = 448
+
+# 離線知識蒸餾：先以 KTG_teacher_topk.py 存下教師模型每個標籤位置的 top-k log-prob，
+# 訓練時以 distill_alpha * KL（溫度 distill_temperature）+ (1 - distill_alpha) * CE 作為損失（設為 None 則停用）
+teacher_topk_dir = None
+distill_alpha = 0.5
+distill_temperature = 2.0
+teacher_topk = TeacherTopK(teacher_topk_dir) if teacher_topk_dir else None
+if teacher_topk is not None and (data_mode == "codeswitch" or pack_utterances):
+    raise ValueError("知識蒸餾需使用 train_format.jsonl 原樣的樣本，不可與 codeswitch 模式或 pack_utterances 同時使用")
+
+def load_audio(audio_filepath):
     # 讀取音檔
-    speech_array, sr = torchaudio.load(example["audio_filepath"])
+    speech_array, sr = torchaudio.load(audio_filepath)
     if sr != 16000:
         resampler = torchaudio.transforms.Resample(sr, 16000)
         speech_array = resampler(speech_array)
     
-    speech_array = speech_array.squeeze().numpy()
+    return speech_array.squeeze().numpy()
+
+def compute_features(audio_filepath):
+    # 打包樣本的 audio_filepath 為多個音檔，依序串接
+    if isinstance(audio_filepath, (list, tuple)):
+        speech_array = np.concatenate([load_audio(path) for path in audio_filepath])
+    else:
+        speech_array = load_audio(audio_filepath)
     
-    input_features = processor.feature_extractor(speech_array, sampling_rate=16000).input_features[0]
+    return processor.feature_extractor(speech_array, sampling_rate=16000).input_features[0]
+
+def get_duration(audio_filepath):
+    # 只讀取檔頭取得音長（秒）
+    info = torchaudio.info(audio_filepath)
+    return info.num_frames / info.sample_rate
+
+def format_timestamp(seconds):
+    # Whisper 時間戳記解析度為 0.02 秒
+    return f"<|{round(seconds / 0.02) * 0.02:.2f}|>"
+
+def pack_dataset(dataset):
+    """ 依原順序貪婪打包：音長總和不超過 max_window_seconds，標籤不超過 max_label_tokens """
+    paths = dataset["audio_filepath"]
+    texts = dataset["text"]
+    if "duration" in dataset.column_names:
+        durations = dataset["duration"]
+    else:
+        durations = [get_duration(path) for path in paths]
+
+    tokenizer = processor.tokenizer
+    # 前綴（語言、任務等）與結尾的特殊 token 也算在預算內
+    token_budget = max_label_tokens - len(tokenizer("").input_ids)
+    token_counts = [len(ids) for ids in tokenizer(texts, add_special_tokens=False).input_ids]
+    separator_tokens = len(tokenizer(pack_separator, add_special_tokens=False).input_ids)
+    timestamp_tokens = 2 if pack_timestamps else 0
+    # 有時間戳記時分隔符放在每段文字前（<|t0|> text<|t1|>），結束與開始時間戳記之間不可插入其他 token
+    segment_tokens = timestamp_tokens + (separator_tokens if pack_timestamps else 0)
+    join_tokens = 0 if pack_timestamps else separator_tokens
+
+    groups = []
+    current, current_duration, current_tokens = [], 0.0, 0
+    for i, (duration, n_tokens) in enumerate(zip(durations, token_counts)):
+        needed = n_tokens + segment_tokens + (join_tokens if current else 0)
+        if current and (current_duration + duration > max_window_seconds or current_tokens + needed > token_budget):
+            groups.append(current)
+            current, current_duration, current_tokens = [], 0.0, 0
+            needed = n_tokens + segment_tokens
+        current.append(i)
+        current_duration += duration
+        current_tokens += needed
+    if current:
+        groups.append(current)
+
+    packed_paths, packed_texts = [], []
+    for group in groups:
+        segments = []
+        offset = 0.0
+        for i in group:
+            if pack_timestamps:
+                segments.append(f"{format_timestamp(offset)}{pack_separator}{texts[i]}{format_timestamp(offset + durations[i])}")
+            else:
+                segments.append(texts[i])
+            offset += durations[i]
+        packed_paths.append([paths[i] for i in group])
+        packed_texts.append(("" if pack_timestamps else pack_separator).join(segments))
+
+    print(f"打包完成：{len(paths)} 筆音檔 -> {len(groups)} 個 {max_window_seconds:.0f} 秒視窗")
+    return Dataset.from_dict({"audio_filepath": packed_paths, "text": packed_texts})
+
+def prepare_example(example):
+    # 快取命中時直接讀取特徵，否則計算後寫入快取
+    if feature_cache is not None:
+        input_features = feature_cache.get_or_compute(example["audio_filepath"], compute_features)
+    else:
+        input_features = compute_features(example["audio_filepath"])
     example["input_features"] = input_features
 
     labels = processor.tokenizer(example["text"], max_length=448, truncation=True).input_ids
     example["labels"] = labels
+    if teacher_topk is not None:
+        # 教師輸出以音檔路徑與標籤 token 對應，未涵蓋的樣本回傳空陣列（只計 CE）
+        example["teacher_ids"], example["teacher_logprobs"] = teacher_topk.lookup(example["audio_filepath"], labels)
     return example
 
-dataset = dataset.map(prepare_example)
+def prepare_synthesized(example):
+    # 即時合成的樣本已是 16kHz 音訊，直接抽取特徵
+    input_features = processor.feature_extractor(example["audio"], sampling_rate=16000).input_features[0]
+    labels = processor.tokenizer(example["text"], max_length=448, truncation=True).input_ids
+    return {"input_features": input_features, "labels": labels}
+
+def prepare_batch(batch):
+    # set_transform 會以 {欄位: list} 的批次形式呼叫
+    examples = [prepare_example({"audio_filepath": path, "text": text})
+                for path, text in zip(batch["audio_filepath"], batch["text"])]
+    columns = ["input_features", "labels"] + (["teacher_ids", "teacher_logprobs"] if teacher_topk is not None else [])
+    return {column: [example[column] for example in examples] for column in columns}
+
+if data_mode != "codeswitch":
+    # 載入資料集
+    dataset = load_dataset("json", data_files={"train": "train_format.jsonl"}, split="train")
+
+    if pack_utterances:
+        dataset = pack_dataset(dataset)
+        if pack_timestamps:
+            # 含時間戳記的標籤不可帶 <|notimestamps|> 前綴
+            processor.tokenizer.set_prefix_tokens(predict_timestamps=True)
+
+if data_mode == "codeswitch":
+    dataset = CodeSwitchStream(load_corpus(), samples_per_epoch=codeswitch_samples_per_epoch,
+                               transform=prepare_synthesized)
+elif data_mode == "lazy":
+    dataset.set_transform(prepare_batch)
+elif data_mode == "precompute":
+    feature_shape = (processor.feature_extractor.feature_size, processor.feature_extractor.nb_max_frames)
+    features = dataset.features.copy()
+    features["input_features"] = Array2D(shape=feature_shape, dtype="float16")
+    features["labels"] = Sequence(Value("int32"))
+    columns = ["input_features", "labels"]
+    if teacher_topk is not None:
+        features["teacher_ids"] = Array2D(shape=(None, teacher_topk.k), dtype="int32")
+        features["teacher_logprobs"] = Array2D(shape=(None, teacher_topk.k), dtype="float16")
+        columns += ["teacher_ids", "teacher_logprobs"]
+    dataset = dataset.map(prepare_example, num_proc=num_proc, features=features)
+    dataset = dataset.with_format("numpy", columns=columns, output_all_columns=True)
+else:
+    dataset = dataset.map(prepare_example)
 
 def data_collator(batch):
-    # 動態 padding
-    input_features = [torch.tensor(item["input_features"], dtype=torch.float) for item in batch]
-    labels = [torch.tensor(item["labels"], dtype=torch.long) for item in batch]
+    # 動態 padding（float16 快取特徵在此轉回 float32）
+    input_features = [torch.as_tensor(np.asarray(item["input_features"]), dtype=torch.float) for item in batch]
+    labels = [torch.as_tensor(np.asarray(item["labels"]), dtype=torch.long) for item in batch]
     input_features = pad_sequence(input_features, batch_first=True, padding_value=0)
     labels = pad_sequence(labels, batch_first=True, padding_value=-100)
-    return {"input_features": input_features, "labels": labels}
+    inputs = {"input_features": input_features, "labels": labels}
+    if teacher_topk is not None:
+        # 教師 top-k 補齊到標籤長度；teacher_mask 標記有教師輸出的位置
+        teacher_ids = torch.zeros(labels.shape + (teacher_topk.k,), dtype=torch.long)
+        teacher_logprobs = torch.zeros(labels.shape + (teacher_topk.k,), dtype=torch.float)
+        teacher_mask = torch.zeros(labels.shape, dtype=torch.bool)
+        for i, item in enumerate(batch):
+            length = len(item["teacher_ids"])
+            teacher_ids[i, :length] = torch.as_tensor(np.asarray(item["teacher_ids"]), dtype=torch.long)
+            teacher_logprobs[i, :length] = torch.as_tensor(np.asarray(item["teacher_logprobs"]), dtype=torch.float)
+            teacher_mask[i, :length] = True
+        inputs.update(teacher_ids=teacher_ids, teacher_logprobs=teacher_logprobs, teacher_mask=teacher_mask)
+    return inputs
+
+class DistillationTrainer(Trainer):
+    """ 以教師 top-k 分佈蒸餾：損失 = alpha * KL(teacher || student) * T^2 + (1 - alpha) * CE """
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        teacher_ids = inputs.pop("teacher_ids")
+        teacher_logprobs = inputs.pop("teacher_logprobs")
+        teacher_mask = inputs.pop("teacher_mask")
+        outputs = model(**inputs)
+        ce_loss = outputs.loss
+
+        # 教師與學生皆只在教師的 top-k token 上重新正規化後比較
+        temperature = distill_temperature
+        # 先取出 top-k 再轉 float32，避免複製整個詞表的 logits（fp16 訓練時每步數百 MB）
+        student_logprobs = torch.log_softmax(outputs.logits.gather(-1, teacher_ids).float() / temperature, dim=-1)
+        teacher_logprobs = torch.log_softmax(teacher_logprobs.float() / temperature, dim=-1)
+        kl = (teacher_logprobs.exp() * (teacher_logprobs - student_logprobs)).sum(-1)
+        mask = teacher_mask & (inputs["labels"] != -100)
+        if mask.any():
+            kl_loss = (kl * mask).sum() / mask.sum()
+            loss = distill_alpha * kl_loss * temperature ** 2 + (1 - distill_alpha) * ce_loss
+        else:
+            loss = ce_loss
+        return (loss, outputs) if return_outputs else loss
 
 # 設定訓練參數
 training_args = TrainingArguments(
@@ -46,6 +233,7 @@ training_args = TrainingArguments(
     per_device_train_batch_size=6,         
     gradient_accumulation_steps=2,         
     num_train_epochs=3,                     
+    max_steps=codeswitch_max_steps if data_mode == "codeswitch" else -1,
     learning_rate=1e-5,                      
     warmup_steps=1000,                       
     logging_steps=10,
@@ -53,9 +241,11 @@ training_args = TrainingArguments(
     fp16=True,                             
     evaluation_strategy="no",              
     remove_unused_columns=False,
+    dataloader_num_workers=dataloader_num_workers,
 )
 
-trainer = Trainer(
+trainer_class = DistillationTrainer if teacher_topk is not None else Trainer
+trainer = trainer_class(
     model=model,
     args=training_args,
     train_dataset=dataset,
@@ -1,5 +1,9 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
 import jiwer
-from difflib import SequenceMatcher
 
 def normalize_text(text):
     """
@@ -8,37 +12,68 @@ def normalize_text(text):
     """
     return text.lower()
 
-def highlight_differences(ref, hyp):
+def highlight_alignment(ref_words, hyp_words, alignment):
     """
-    Compare reference and hypothesis and highlight differences.
+    Render a jiwer word alignment as highlighted reference / hypothesis strings.
     - Deletion: [DEL: word]
     - Substitution: [SUB: original -> new]
     - Insertion: [INS: word]
     """
-    ref_words = ref.split()
-    hyp_words = hyp.split()
-    
-    matcher = SequenceMatcher(None, ref_words, hyp_words)
     highlighted_ref = []
     highlighted_hyp = []
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == "equal":
-            highlighted_ref.extend(ref_words[i1:i2])
-            highlighted_hyp.extend(hyp_words[j1:j2])
-        elif tag == "replace":
-            for rw, hw in zip(ref_words[i1:i2], hyp_words[j1:j2]):
+
+    for chunk in alignment:
+        ref_chunk = ref_words[chunk.ref_start_idx:chunk.ref_end_idx]
+        hyp_chunk = hyp_words[chunk.hyp_start_idx:chunk.hyp_end_idx]
+        if chunk.type == "equal":
+            highlighted_ref.extend(ref_chunk)
+            highlighted_hyp.extend(hyp_chunk)
+        elif chunk.type == "substitute":
+            for rw, hw in zip(ref_chunk, hyp_chunk):
                 highlighted_ref.append(f"[SUB: {rw} -> {hw}]")
                 highlighted_hyp.append(f"[SUB: {hw}]")
-        elif tag == "delete":
-            for rw in ref_words[i1:i2]:
+        elif chunk.type == "delete":
+            for rw in ref_chunk:
                 highlighted_ref.append(f"[DEL: {rw}]")
-        elif tag == "insert":
-            for hw in hyp_words[j1:j2]:
+        elif chunk.type == "insert":
+            for hw in hyp_chunk:
                 highlighted_hyp.append(f"[INS: {hw}]")
-                
+
     return " ".join(highlighted_ref), " ".join(highlighted_hyp)
 
+def highlight_differences(ref, hyp):
+    """
+    Compare reference and hypothesis and highlight differences
+    using the same alignment as the S/D/I counts.
+    """
+    output = jiwer.process_words(ref, hyp)
+    return highlight_alignment(output.references[0], output.hypotheses[0], output.alignments[0])
+
+def score_utterance(item):
+    """
+    Align one (id, reference, hypothesis) triple once and return its
+    S/D/I counts together with the highlighted differences.
+    """
+    news_id, ref_text, hyp_text = item
+    ref_norm = normalize_text(ref_text)
+    hyp_norm = normalize_text(hyp_text)
+
+    output = jiwer.process_words(ref_norm, hyp_norm)
+    highlighted_ref, highlighted_hyp = highlight_alignment(output.references[0], output.hypotheses[0], output.alignments[0])
+
+    return {
+        "id": news_id,
+        "reference": ref_text,
+        "hypothesis": hyp_text,
+        "wer": output.wer,
+        "substitutions": output.substitutions,
+        "deletions": output.deletions,
+        "insertions": output.insertions,
+        "word_count": len(ref_norm.split()),
+        "highlighted_ref": highlighted_ref,
+        "highlighted_hyp": highlighted_hyp,
+    }
+
 def load_data_by_id(file_path):
     """
     Load text data from file and return as a dict: {id: content}.
@@ -57,7 +92,147 @@ def load_data_by_id(file_path):
                 data[news_id] = content
     return data
 
-def calculate_wer_with_highlights_by_id(reference_file, hypothesis_file, output_file="mer_results.txt"):
+# Fields of a score_utterance result that depend only on the normalized texts
+SCORE_FIELDS = ("wer", "substitutions", "deletions", "insertions", "word_count", "highlighted_ref", "highlighted_hyp")
+
+def score_key(ref_text, hyp_text):
+    """
+    Cache key of an utterance: hash of the normalized reference and hypothesis.
+    """
+    return hashlib.sha1(f"{normalize_text(ref_text)}\0{normalize_text(hyp_text)}".encode("utf-8")).hexdigest()
+
+class ScoreCache:
+    """
+    Persistent SQLite cache of per-utterance scores (S/D/I, word count and
+    highlights), so re-running across checkpoints / decode settings only
+    aligns the lines whose normalized reference or hypothesis changed.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score TEXT NOT NULL)")
+
+    def get_many(self, keys, batch_size=500):
+        found = {}
+        keys = list(set(keys))
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            for key, score in self.conn.execute(f"SELECT key, score FROM scores WHERE key IN ({placeholders})", batch):
+                found[key] = json.loads(score)
+        return found
+
+    def put_many(self, entries):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO scores (key, score) VALUES (?, ?)",
+                                  [(key, json.dumps({field: result[field] for field in SCORE_FIELDS}, ensure_ascii=False))
+                                   for key, result in entries])
+
+    def close(self):
+        self.conn.close()
+
+def iter_scores(items, pool=None, cache=None, chunksize=64, flush_every=1000):
+    """
+    Yield score_utterance results for (id, ref, hyp) items in order. With a cache,
+    only new or changed lines are aligned (in the pool); the rest are read back.
+    """
+    items = list(items)
+    keys = [score_key(ref_text, hyp_text) for _, ref_text, hyp_text in items] if cache else []
+    cached = cache.get_many(keys) if cache else {}
+    if cache:
+        # Each new key is aligned once, even if the same line pair repeats
+        pending = {}
+        for item, key in zip(items, keys):
+            if key not in cached:
+                pending.setdefault(key, item)
+        misses = list(pending.values())
+        print(f"Score cache: {len(items) - len(misses)} cached, {len(misses)} to compute")
+    else:
+        misses = items
+
+    computed = pool.imap(score_utterance, misses, chunksize=chunksize) if pool else map(score_utterance, misses)
+    new_entries = []
+    for index, (news_id, ref_text, hyp_text) in enumerate(items):
+        key = keys[index] if cache else None
+        if key in cached:
+            result = {"id": news_id, "reference": ref_text, "hypothesis": hyp_text, **cached[key]}
+        else:
+            result = next(computed)
+            if cache:
+                cached[key] = {field: result[field] for field in SCORE_FIELDS}
+                new_entries.append((key, result))
+                if len(new_entries) >= flush_every:
+                    cache.put_many(new_entries)
+                    new_entries = []
+        yield result
+    if cache and new_entries:
+        cache.put_many(new_entries)
+
+def write_result(out_f, result):
+    out_f.write(f"-- ID: {result['id']}\n")
+    out_f.write(f"    Reference: {result['reference']}\n")
+    out_f.write(f"    Hypothesis: {result['hypothesis']}\n")
+    out_f.write(f"    WER: {result['wer']:.4f}\n")
+    out_f.write(f"    Deletions (D): {result['deletions']}\n")
+    out_f.write(f"    Substitutions (S): {result['substitutions']}\n")
+    out_f.write(f"    Insertions (I): {result['insertions']}\n")
+    out_f.write(f"    Word Count: {result['word_count']}\n")
+    out_f.write(f"    Highlighted Differences:\n")
+    out_f.write(f"        Ref: {result['highlighted_ref']}\n")
+    out_f.write(f"        Hyp: {result['highlighted_hyp']}\n\n")
+
+class PerUtteranceWriter:
+    """
+    Machine-readable per-utterance output: JSONL is streamed line by line,
+    Parquet (requires pyarrow) is written in record batches.
+    """
+
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.records = []
+        self.parquet = path.endswith(".parquet")
+        self._file = None if self.parquet else open(path, "w", encoding="utf-8")
+        self._writer = None
+
+    def write(self, result):
+        if self._file is not None:
+            self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            return
+        self.records.append(result)
+        if len(self.records) >= self.batch_size:
+            self._flush_parquet()
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.records:
+            return
+        table = pa.Table.from_pylist(self.records)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+        self.records = []
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        else:
+            self._flush_parquet()
+            if self._writer is not None:
+                self._writer.close()
+
+def calculate_wer_with_highlights_by_id(reference_file, hypothesis_file, output_file="mer_results.txt",
+                                        per_utterance_file=None, num_workers=None, chunksize=64,
+                                        score_cache_file=None):
+    """
+    Score every common ID with a single alignment per utterance, spread over
+    num_workers processes. Results are streamed to output_file in sorted ID order;
+    per_utterance_file (.jsonl or .parquet) optionally receives the same results.
+    With score_cache_file, unchanged lines are taken from the persistent cache.
+    """
     # Load reference and hypothesis data
     ref_data = load_data_by_id(reference_file)
     hyp_data = load_data_by_id(hypothesis_file)
@@ -76,61 +251,118 @@ def calculate_wer_with_highlights_by_id(reference_file, hypothesis_file, output_
     total_del = 0
     total_ins = 0
     total_sub = 0
+
+    items = ((news_id, ref_data[news_id], hyp_data[news_id]) for news_id in sorted(common_ids))
+    num_workers = num_workers or os.cpu_count() or 1
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    per_utterance = PerUtteranceWriter(per_utterance_file) if per_utterance_file else None
+    cache = ScoreCache(score_cache_file) if score_cache_file else None
     
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        out_f.write("=== Per-sample WER results ===\n\n")
-        
-        for news_id in sorted(common_ids):
-            ref_text = ref_data[news_id]
-            hyp_text = hyp_data[news_id]
+    try:
+        results = iter_scores(items, pool, cache, chunksize)
+        with open(output_file, 'w', encoding='utf-8') as out_f:
+            out_f.write("=== Per-sample WER results ===\n\n")
             
-            ref_norm = normalize_text(ref_text)
-            hyp_norm = normalize_text(hyp_text)
-            
-            measures = jiwer.compute_measures(ref_norm, hyp_norm)
-            wer = measures['wer']
-            substitutions = measures['substitutions']
-            deletions = measures['deletions']
-            insertions = measures['insertions']
-            word_count = len(ref_norm.split())
-            
-            total_errors += substitutions + deletions + insertions
-            total_words += word_count
-            total_del += deletions
-            total_ins += insertions
-            total_sub += substitutions
+            for result in results:
+                total_errors += result["substitutions"] + result["deletions"] + result["insertions"]
+                total_words += result["word_count"]
+                total_del += result["deletions"]
+                total_ins += result["insertions"]
+                total_sub += result["substitutions"]
+                
+                write_result(out_f, result)
+                if per_utterance is not None:
+                    per_utterance.write(result)
             
-            highlighted_ref, highlighted_hyp = highlight_differences(ref_norm, hyp_norm)
+            # Summary
+            overall_wer = total_errors / total_words if total_words > 0 else 0
+            overall_del = total_del / total_words if total_words > 0 else 0
+            overall_ins = total_ins / total_words if total_words > 0 else 0
+            overall_sub = total_sub / total_words if total_words > 0 else 0
             
-            out_f.write(f"-- ID: {news_id}\n")
-            out_f.write(f"    Reference: {ref_text}\n")
-            out_f.write(f"    Hypothesis: {hyp_text}\n")
-            out_f.write(f"    WER: {wer:.4f}\n")
-            out_f.write(f"    Deletions (D): {deletions}\n")
-            out_f.write(f"    Substitutions (S): {substitutions}\n")
-            out_f.write(f"    Insertions (I): {insertions}\n")
-            out_f.write(f"    Word Count: {word_count}\n")
-            out_f.write(f"    Highlighted Differences:\n")
-            out_f.write(f"        Ref: {highlighted_ref}\n")
-            out_f.write(f"        Hyp: {highlighted_hyp}\n\n")
-        
-        # Summary
-        overall_wer = total_errors / total_words if total_words > 0 else 0
-        overall_del = total_del / total_words if total_words > 0 else 0
-        overall_ins = total_ins / total_words if total_words > 0 else 0
-        overall_sub = total_sub / total_words if total_words > 0 else 0
-        
-        out_f.write("=== Overall WER Summary ===\n")
-        out_f.write(f"   Overall WER: {overall_wer:.4f}\n")
-        out_f.write(f"   Deletion Rate: {overall_del:.4f}\n")
-        out_f.write(f"   Insertion Rate: {overall_ins:.4f}\n")
-        out_f.write(f"   Substitution Rate: {overall_sub:.4f}\n")
-        out_f.write(f"   Total Words: {total_words}\n")
+            out_f.write("=== Overall WER Summary ===\n")
+            out_f.write(f"   Overall WER: {overall_wer:.4f}\n")
+            out_f.write(f"   Deletion Rate: {overall_del:.4f}\n")
+            out_f.write(f"   Insertion Rate: {overall_ins:.4f}\n")
+            out_f.write(f"   Substitution Rate: {overall_sub:.4f}\n")
+            out_f.write(f"   Total Words: {total_words}\n")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if per_utterance is not None:
+            per_utterance.close()
+        if cache is not None:
+            cache.close()
     
     print(f"\nWER evaluation complete. Results saved to {output_file}")
     return overall_wer
 
-# Example usage
-reference_txt = "ref.txt"
-hypothesis_txt = "hyp.txt"
-calculate_wer_with_highlights_by_id(reference_txt, hypothesis_txt)
+def compare_hypotheses(reference_file, hypothesis_file_a, hypothesis_file_b, output_file="mer_compare.txt",
+                       num_workers=None, chunksize=64, score_cache_file=None):
+    """
+    Score two hypothesis files (e.g. two checkpoints) against the same reference
+    in one pass and write a side-by-side report of the utterances whose WER differs.
+    """
+    ref_data = load_data_by_id(reference_file)
+    hyp_a = load_data_by_id(hypothesis_file_a)
+    hyp_b = load_data_by_id(hypothesis_file_b)
+    common_ids = sorted(set(ref_data) & set(hyp_a) & set(hyp_b))
+
+    num_workers = num_workers or os.cpu_count() or 1
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    cache = ScoreCache(score_cache_file) if score_cache_file else None
+
+    totals = {"A": [0, 0], "B": [0, 0]}  # [errors, words]
+    improved = regressed = unchanged = 0
+    try:
+        items = [(news_id, ref_data[news_id], hyp_a[news_id]) for news_id in common_ids]
+        items += [(news_id, ref_data[news_id], hyp_b[news_id]) for news_id in common_ids]
+        results = iter_scores(items, pool, cache, chunksize)
+        results_a = [next(results) for _ in common_ids]
+
+        with open(output_file, 'w', encoding='utf-8') as out_f:
+            out_f.write(f"=== Side-by-side comparison: A = {hypothesis_file_a}, B = {hypothesis_file_b} ===\n\n")
+            for result_a in results_a:
+                result_b = next(results)
+                for name, result in (("A", result_a), ("B", result_b)):
+                    totals[name][0] += result["substitutions"] + result["deletions"] + result["insertions"]
+                    totals[name][1] += result["word_count"]
+
+                if result_a["wer"] == result_b["wer"]:
+                    unchanged += 1
+                    continue
+                if result_b["wer"] < result_a["wer"]:
+                    improved += 1
+                else:
+                    regressed += 1
+                out_f.write(f"-- ID: {result_a['id']}\n")
+                out_f.write(f"    Reference: {result_a['reference']}\n")
+                out_f.write(f"    A (WER {result_a['wer']:.4f}): {result_a['highlighted_hyp']}\n")
+                out_f.write(f"    B (WER {result_b['wer']:.4f}): {result_b['highlighted_hyp']}\n")
+                out_f.write(f"    Delta (B - A): {result_b['wer'] - result_a['wer']:+.4f}\n\n")
+
+            wer_a = totals["A"][0] / totals["A"][1] if totals["A"][1] > 0 else 0
+            wer_b = totals["B"][0] / totals["B"][1] if totals["B"][1] > 0 else 0
+            out_f.write("=== Comparison Summary ===\n")
+            out_f.write(f"   Overall WER A: {wer_a:.4f}\n")
+            out_f.write(f"   Overall WER B: {wer_b:.4f}\n")
+            out_f.write(f"   Improved (B < A): {improved}\n")
+            out_f.write(f"   Regressed (B > A): {regressed}\n")
+            out_f.write(f"   Unchanged: {unchanged}\n")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.close()
+
+    print(f"\nComparison complete. Results saved to {output_file}")
+    return wer_a, wer_b
+
+if __name__ == "__main__":
+    # Example usage
+    reference_txt = "ref.txt"
+    hypothesis_txt = "hyp.txt"
+    calculate_wer_with_highlights_by_id(reference_txt, hypothesis_txt, per_utterance_file="mer_results.jsonl",
+                                        score_cache_file="mer_score_cache.sqlite")
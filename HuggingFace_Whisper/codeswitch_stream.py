@@ -0,0 +1,87 @@
+import os
+import random
+import sys
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data_prepare"))
+import CodeSwitch_Data_merge as codeswitch
+
+def load_corpus(languages=None):
+    """
+    Load {lang: [(audio_file, tagged transcript, duration_ms, lang), ...]} using the
+    cached duration manifests of CodeSwitch_Data_merge.
+    """
+    languages = languages or codeswitch.languages
+    return {lang: codeswitch.load_transcripts(path, lang) for lang, path in languages.items()}
+
+class CodeSwitchStream(IterableDataset):
+    """
+    Synthesizes code-switched training examples on the fly, with the same language
+    tags, switch counts and length limits as CodeSwitch_Data_merge, but without
+    writing any audio to disk.
+
+    Each epoch yields samples_per_epoch examples split across DataLoader workers.
+    Every (seed, epoch, worker) gets its own RNG stream, so runs are reproducible
+    and each epoch produces fresh mixtures. Call set_epoch() before iterating
+    (Trainer does this through the DataLoader).
+    """
+
+    def __init__(self, all_data, switch_counts=None, seed=codeswitch.seed, samples_per_epoch=None,
+                 audio_cache_mb=512, transform=None):
+        self.all_data = all_data
+        self.switch_counts = switch_counts or codeswitch.switch_counts
+        self.seed = seed
+        self.samples_per_epoch = samples_per_epoch or sum(self.switch_counts.values())
+        self.audio_cache_mb = audio_cache_mb  # Per worker
+        self.transform = transform
+        self.epoch = 0
+        self._check_clips_fit()
+
+    def _check_clips_fit(self):
+        """
+        Fail early if a switch count can never be filled: pick_clips then returns
+        nothing forever and every DataLoader worker would hang.
+        """
+        indexes, available_languages = codeswitch.build_indexes(self.all_data)
+        if not available_languages:
+            raise ValueError("Code-switch corpus is empty: no language has any clips")
+        shortest = min(indexes[lang].durations[0] for lang in available_languages)
+        unfillable = [count for count, weight in self.switch_counts.items()
+                      if weight > 0 and shortest > codeswitch.max_length_for(count)]
+        if unfillable:
+            raise ValueError(f"No clip fits the length limit of switch counts {unfillable} "
+                             f"(shortest clip {shortest} ms, limits "
+                             f"{[codeswitch.max_length_for(count) for count in unfillable]} ms)")
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        num_samples = self.samples_per_epoch // num_workers + (worker_id < self.samples_per_epoch % num_workers)
+
+        rng = random.Random(f"{self.seed}:{self.epoch}:{worker_id}")
+        indexes, available_languages = codeswitch.build_indexes(self.all_data)
+        if not available_languages:
+            return
+        audio_cache = codeswitch.AudioCache(self.audio_cache_mb * 1024 ** 2)
+        # Switch counts are drawn in the same proportions as the offline set
+        switch_choices = list(self.switch_counts)
+        switch_weights = [self.switch_counts[count] for count in switch_choices]
+
+        produced = 0
+        while produced < num_samples:
+            switch_count = rng.choices(switch_choices, weights=switch_weights)[0]
+            picks = codeswitch.pick_clips(rng, indexes, available_languages, switch_count,
+                                          codeswitch.max_length_for(switch_count))
+            if not picks:
+                continue
+            audio = np.concatenate([audio_cache.get(audio_file) for audio_file, _, _, _ in picks])
+            example = {
+                "audio": audio.astype(np.float32) / 32768.0,
+                "text": " ".join(transcript for _, transcript, _, _ in picks),
+            }
+            produced += 1
+            yield self.transform(example) if self.transform is not None else example
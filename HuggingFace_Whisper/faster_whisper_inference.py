@@ -1,28 +1,157 @@
 import os
-from faster_whisper import WhisperModel
+import multiprocessing
+from faster_whisper import WhisperModel, decode_audio
 from tqdm import tqdm
+import stage_profiler
+from transcription_cache import TranscriptionCache, collect_finished, write_merged_output
+from transcriptions_normalize import normalize_text
+
+try:
+    from faster_whisper import BatchedInferencePipeline  # faster-whisper >= 1.1
+except ImportError:
+    BatchedInferencePipeline = None
 
 # 模型路徑
 model_path = "faster_whisper"
-# 選擇 GPU 或 CPU 運行
-device = "cuda" 
-compute_type = "float16" if device == "cuda" else "int8"
-
-model = WhisperModel(model_path, device=device, compute_type=compute_type)
+# 選擇 GPU 或 CPU 運行（"auto" 會自動偵測是否有 CUDA 裝置）
+device = "auto"
 
-audio_folder = "test_audio"  # 音檔資料夾路徑
+audio_folder = "test_audio"  # 音檔資料夾路徑（含子資料夾）
 output_file = "transcriptions.txt"  # 轉錄文本
+normalized_output_file = None  # 例如 "hyp.txt"：同時寫出正規化後的文本，可直接給 MER.py 使用
+resume = False  # 續跑模式：跳過快取中以相同模型與設定完成的音檔
+decode_settings = {"beam_size": 5, "language": "zh"}
+
+# CPU 平行設定
+batch_size = 8  # 批次解碼的分段數（0 = 不使用 BatchedInferencePipeline，逐段解碼）
+num_processes = 0  # CPU 行程數，每個行程分一份音檔清單（0 = 自動，每 4 核一個行程）
+cpu_threads = 0  # 所有行程合計的 CPU 執行緒數（0 = 全部核心），平均分配給各行程
+num_workers = 1  # 每個 WhisperModel 內可同時執行的轉錄數
+
+# 各階段計時（選用）：寫出 <profile_output>.jsonl（逐檔 + 總結）與 <profile_output>.trace.json（Chrome trace），None 為停用
+profile_output = None
+
+def detect_device():
+    """ 有 CUDA 裝置時使用 GPU，否則使用 CPU """
+    try:
+        import ctranslate2
+        return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    except Exception:
+        return "cpu"
+
+def use_batched_pipeline():
+    """ 是否使用 BatchedInferencePipeline（VAD 切段、不以前文為條件，轉錄結果與逐段解碼不同） """
+    return batch_size > 0 and BatchedInferencePipeline is not None
+
+def load_model(device, threads):
+    compute_type = "float16" if device == "cuda" else "int8"
+    model = WhisperModel(model_path, device=device, compute_type=compute_type,
+                         cpu_threads=threads, num_workers=num_workers)
+    if use_batched_pipeline():
+        return BatchedInferencePipeline(model=model)
+    return model
+
+def transcribe_file(model, audio_path):
+    try:
+        # 分段計時：讀檔與重取樣 / 特徵與 VAD / 解碼（segments 為 generator，迭代時才解碼）
+        with stage_profiler.stage("load_audio", file=audio_path):
+            audio = decode_audio(audio_path, sampling_rate=16000)
+        profiler = stage_profiler.active()
+        if profiler is not None:
+            profiler.set_file_info(audio_path, audio_seconds=len(audio) / 16000)
+
+        with stage_profiler.stage("features", file=audio_path):
+            if BatchedInferencePipeline is not None and isinstance(model, BatchedInferencePipeline):
+                segments, _ = model.transcribe(audio, batch_size=batch_size, **decode_settings)
+            else:
+                segments, _ = model.transcribe(audio, **decode_settings)
+        with stage_profiler.stage("generate", files=[audio_path]) as stage_args:
+            segments = list(segments)
+            stage_args["tokens"] = [sum(len(segment.tokens) for segment in segments)]
+        return " ".join(segment.text for segment in segments)
+    except Exception as e:
+        print(f"轉錄失敗：{audio_path}，錯誤信息：{e}")
+        return None
+
+# 每個子行程各自載入一份模型
+_worker_model = None
+
+def init_worker(device, threads, profile=False):
+    global _worker_model
+    if profile:
+        stage_profiler.enable()
+    _worker_model = load_model(device, threads)
+
+def worker_transcribe(audio_path):
+    transcription = transcribe_file(_worker_model, audio_path)
+    # 子行程的計時資料隨結果傳回主行程合併
+    profiler = stage_profiler.active()
+    return audio_path, transcription, profiler.drain() if profiler is not None else None
+
+def transcribe_folder(audio_folder, output_file):
+    run_device = detect_device() if device == "auto" else device
+    compute_type = "float16" if run_device == "cuda" else "int8"
+
+    audio_paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(audio_folder)
+        for file in files if file.endswith(".wav")
+    )
+
+    profiler = stage_profiler.enable() if profile_output else None
+    transcriptions = {}
+    cache = None
+    pending_paths = audio_paths
+    if resume:
+        # 讀回上次（可能中斷）的結果，只轉錄新增或未完成的音檔（快取鍵含模型檔案的大小與修改時間）
+        batched = use_batched_pipeline()
+        cache = TranscriptionCache(output_file + ".cache.jsonl", model_path,
+                                   {"backend": "faster_whisper", "compute_type": compute_type, "batched": batched,
+                                    "batch_size": batch_size if batched else 0, **decode_settings})
+        transcriptions, pending_paths = collect_finished(audio_paths, cache)
+        print(f"續跑模式：{len(audio_paths) - len(pending_paths)} 個音檔已完成，剩餘 {len(pending_paths)} 個")
+
+    total_threads = cpu_threads or os.cpu_count() or 1
+    if run_device == "cuda":
+        processes = 1
+    else:
+        processes = num_processes or max(1, total_threads // 4)
+    processes = max(1, min(processes, len(pending_paths)))
+    # 各行程平分執行緒，避免 processes x cpu_threads 超出核心數
+    threads_per_process = max(1, total_threads // processes)
+    print(f"裝置：{run_device}，行程數：{processes}，每行程執行緒：{threads_per_process}")
+
+    def record(audio_path, transcription):
+        transcriptions[audio_path] = transcription
+        if cache is not None and transcription:
+            cache.add(audio_path, transcription)
 
-audio_files = [f for f in os.listdir(audio_folder) if f.endswith(".wav")]
+    if not pending_paths:
+        print("沒有需要轉錄的音檔")
+    elif processes == 1:
+        model = load_model(run_device, threads_per_process)
+        for audio_path in tqdm(pending_paths, desc="Processing files"):
+            record(audio_path, transcribe_file(model, audio_path))
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes, initializer=init_worker, initargs=(run_device, threads_per_process, profiler is not None)) as pool:
+            results = pool.imap_unordered(worker_transcribe, pending_paths)
+            for audio_path, transcription, profile in tqdm(results, total=len(pending_paths), desc="Processing files"):
+                record(audio_path, transcription)
+                if profiler is not None:
+                    profiler.merge(profile)
 
-with open(output_file, "w", encoding="utf-8") as out_f:
-    for audio_file in tqdm(audio_files, desc="Processing files"):
-        audio_path = os.path.join(audio_folder, audio_file)
+    if cache is not None:
+        cache.close()
 
-        segments, _ = model.transcribe(audio_path, beam_size=5, language="zh")
+    # 依檔名排序寫出合併結果
+    write_merged_output(output_file, audio_paths, transcriptions)
+    if normalized_output_file:
+        write_merged_output(normalized_output_file, audio_paths, transcriptions, normalize=normalize_text)
 
-        transcription = " ".join(segment.text for segment in segments)
-    
-        out_f.write(f"{audio_path} {transcription}\n")
+    print(f"所有轉錄結果已儲存於 {output_file}")
+    if profiler is not None:
+        profiler.export(profile_output)
 
-print(f"所有轉錄結果已儲存於 {output_file}")
+if __name__ == "__main__":
+    transcribe_folder(audio_folder, output_file)
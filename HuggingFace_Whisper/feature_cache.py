@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+
+# Feature extractor attributes that change the computed log-mel features
+_CONFIG_KEYS = (
+    "feature_size", "sampling_rate", "hop_length", "chunk_length",
+    "n_fft", "n_samples", "nb_max_frames", "padding_value", "dither",
+)
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Return the SHA-1 hex digest of a file's content.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class FeatureCache:
+    """
+    On-disk store of Whisper log-mel features keyed by audio content hash.
+    Each feature extractor config gets its own directory; features are kept
+    as float16 rows of fixed-size memory-mapped .npy shards indexed in SQLite,
+    so training (incl. datasets.map workers) and inference can share it.
+    """
+
+    def __init__(self, cache_dir, feature_extractor, shard_size=1024):
+        config = {key: getattr(feature_extractor, key, None) for key in _CONFIG_KEYS}
+        config_hash = hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+        self.root = os.path.join(cache_dir, config_hash)
+        self.shape = (feature_extractor.feature_size, feature_extractor.nb_max_frames)
+        self.shard_size = shard_size
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2, default=str)
+
+        conn = sqlite3.connect(os.path.join(self.root, "index.sqlite"))
+        with conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, ready INTEGER NOT NULL DEFAULT 0)")
+        conn.close()
+        self._init_local()
+
+    def _init_local(self):
+        # Connections and memmaps are per process / per thread and never pickled
+        self._local = threading.local()
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        return {"root": self.root, "shape": self.shape, "shard_size": self.shard_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local()
+
+    def _conn(self):
+        if self._pid != os.getpid():  # forked worker: drop inherited handles
+            self._init_local()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.sqlite"), timeout=60, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _shard_path(self, shard_id):
+        return os.path.join(self.root, f"shard_{shard_id:06d}.npy")
+
+    def _shard(self, shard_id):
+        with self._shards_lock:
+            shard = self._shards.get(shard_id)
+            if shard is None:
+                shard = np.lib.format.open_memmap(self._shard_path(shard_id), mode="r+")
+                self._shards[shard_id] = shard
+            return shard
+
+    def get(self, key):
+        """
+        Return cached features (float32) for key, or None on a miss.
+        """
+        row = self._conn().execute("SELECT slot FROM features WHERE key = ? AND ready = 1", (key,)).fetchone()
+        if row is None:
+            return None
+        shard_id, index = divmod(row[0], self.shard_size)
+        return np.asarray(self._shard(shard_id)[index], dtype=np.float32)
+
+    def put(self, key, features):
+        """
+        Store features for key (no-op if already present). A row left not ready by
+        a writer that died before filling its slot is filled again here.
+        """
+        features = np.asarray(features, dtype=np.float16)
+        if features.shape != self.shape:
+            raise ValueError(f"Feature shape {features.shape} does not match cache shape {self.shape}")
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT slot, ready FROM features WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1]:
+                conn.execute("COMMIT")
+                return
+            if row is not None:
+                # Same key means same content, so rewriting a slot another writer is
+                # still filling is harmless
+                slot = row[0]
+                shard_id, index = divmod(slot, self.shard_size)
+            else:
+                slot = conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM features").fetchone()[0]
+                shard_id, index = divmod(slot, self.shard_size)
+                if index == 0:
+                    # Allocate the next shard while holding the write lock
+                    np.lib.format.open_memmap(self._shard_path(shard_id), mode="w+", dtype=np.float16,
+                                              shape=(self.shard_size,) + self.shape).flush()
+                conn.execute("INSERT INTO features (key, slot) VALUES (?, ?)", (key, slot))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        shard = self._shard(shard_id)
+        shard[index] = features
+        shard.flush()
+        conn.execute("UPDATE features SET ready = 1 WHERE key = ?", (key,))
+
+    def get_or_compute(self, audio_path, compute_fn):
+        """
+        Return features for audio_path, computing them with compute_fn on a miss.
+        audio_path may also be a list of files whose audio is concatenated
+        (packed training windows); the key then covers all of them in order.
+        Misses return the float16-rounded values so hits and misses agree.
+        """
+        if isinstance(audio_path, (list, tuple)):
+            key = hashlib.sha1("+".join(hash_file(path) for path in audio_path).encode()).hexdigest()
+        else:
+            key = hash_file(audio_path)
+        features = self.get(key)
+        if features is None:
+            features = np.asarray(compute_fn(audio_path), dtype=np.float16)
+            self.put(key, features)
+            features = features.astype(np.float32)
+        return features
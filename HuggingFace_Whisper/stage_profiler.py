@@ -0,0 +1,192 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB (0 if unavailable).
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+class StageProfiler:
+    """
+    Records timed stages (load_audio, resample, features, generate, ...) from any
+    thread or worker process. Stage args tie time to files: "file" for per-file
+    stages, "files" (plus an aligned "tokens" list) for batched stages, whose
+    time is split evenly across the batch.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []  # {"name", "ts" (epoch s), "dur" (s), "pid", "tid", "args"}
+        self.file_info = defaultdict(dict)
+        self.peak_rss = {}
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, **args):
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield args
+        finally:
+            event = {"name": name, "ts": start, "dur": time.perf_counter() - begin,
+                     "pid": self.pid, "tid": threading.get_ident(), "args": args}
+            with self._lock:
+                self.events.append(event)
+
+    def set_file_info(self, audio_path, **info):
+        self.file_info[audio_path].update(info)
+
+    def drain(self):
+        """
+        Hand over recorded events (e.g. from a worker process to the parent).
+        """
+        with self._lock:
+            events, self.events = self.events, []
+            file_info, self.file_info = dict(self.file_info), defaultdict(dict)
+        return {"pid": self.pid, "events": events, "file_info": file_info, "peak_rss_mb": peak_rss_mb()}
+
+    def merge(self, drained):
+        with self._lock:
+            self.events.extend(drained["events"])
+        for audio_path, info in drained["file_info"].items():
+            self.file_info[audio_path].update(info)
+        self.peak_rss[drained["pid"]] = max(self.peak_rss.get(drained["pid"], 0.0), drained["peak_rss_mb"])
+
+    def stop(self):
+        self.finished = time.time()
+        self.peak_rss[self.pid] = peak_rss_mb()
+
+    def per_file(self):
+        files = defaultdict(lambda: {"stages": defaultdict(float), "generated_tokens": 0})
+        for event in self.events:
+            args = event["args"]
+            if "file" in args:
+                files[args["file"]]["stages"][event["name"]] += event["dur"]
+            elif args.get("files"):
+                share = event["dur"] / len(args["files"])
+                tokens = args.get("tokens") or [0] * len(args["files"])
+                for audio_path, n_tokens in zip(args["files"], tokens):
+                    if audio_path is None:
+                        continue
+                    files[audio_path]["stages"][event["name"]] += share
+                    files[audio_path]["generated_tokens"] += n_tokens
+
+        rows = []
+        for audio_path in sorted(files):
+            stages = dict(files[audio_path]["stages"])
+            total = sum(stages.values())
+            audio_seconds = self.file_info.get(audio_path, {}).get("audio_seconds")
+            rows.append({
+                "file": audio_path,
+                "audio_seconds": audio_seconds,
+                "stages": stages,
+                "total_seconds": total,
+                "rtf": total / audio_seconds if audio_seconds else None,
+                "generated_tokens": files[audio_path]["generated_tokens"],
+            })
+        return rows
+
+    def summary(self):
+        rows = self.per_file()
+        wall = (self.finished or time.time()) - self.started
+        stage_totals = defaultdict(float)
+        stage_counts = defaultdict(int)
+        for event in self.events:
+            stage_totals[event["name"]] += event["dur"]
+            stage_counts[event["name"]] += 1
+        audio_seconds = sum(row["audio_seconds"] or 0.0 for row in rows)
+        tokens = sum(row["generated_tokens"] for row in rows)
+        generate_seconds = stage_totals.get("generate", 0.0)
+        return {
+            "files": len(rows),
+            "wall_seconds": wall,
+            "audio_seconds": audio_seconds,
+            "rtf": wall / audio_seconds if audio_seconds else None,
+            "generated_tokens": tokens,
+            "tokens_per_second": tokens / generate_seconds if generate_seconds else None,
+            "stage_seconds": dict(stage_totals),
+            "stage_calls": dict(stage_counts),
+            "peak_rss_mb": max(self.peak_rss.values(), default=peak_rss_mb()),
+            "peak_rss_mb_by_pid": {str(pid): rss for pid, rss in self.peak_rss.items()},
+        }
+
+    def write_jsonl(self, path):
+        """
+        One line per file, followed by a {"summary": ...} line.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for row in self.per_file():
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.write(json.dumps({"summary": self.summary()}, ensure_ascii=False) + "\n")
+
+    def write_chrome_trace(self, path):
+        """
+        Chrome trace event format, viewable in chrome://tracing or Perfetto.
+        """
+        trace = []
+        thread_ids = {}
+        for event in sorted(self.events, key=lambda event: event["ts"]):
+            tid = thread_ids.setdefault((event["pid"], event["tid"]), len(thread_ids))
+            trace.append({
+                "name": event["name"], "cat": "stage", "ph": "X",
+                "ts": (event["ts"] - self.started) * 1e6, "dur": event["dur"] * 1e6,
+                "pid": event["pid"], "tid": tid,
+                "args": {key: value for key, value in event["args"].items() if key != "tokens"},
+            })
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms", "otherData": self.summary()}, f, ensure_ascii=False)
+
+    def export(self, prefix):
+        """
+        Write <prefix>.jsonl and <prefix>.trace.json and print the aggregate numbers.
+        """
+        self.stop()
+        self.write_jsonl(prefix + ".jsonl")
+        self.write_chrome_trace(prefix + ".trace.json")
+        summary = self.summary()
+        print(f"📊 Profile: {summary['files']} files, {summary['audio_seconds']:.1f}s audio in {summary['wall_seconds']:.1f}s "
+              f"(RTF {summary['rtf'] or 0:.3f}), {summary['tokens_per_second'] or 0:.1f} tokens/s, "
+              f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+        for name, seconds in sorted(summary["stage_seconds"].items(), key=lambda item: -item[1]):
+            print(f"   {name:<16} {seconds:8.2f}s over {summary['stage_calls'][name]} calls")
+        print(f"   Saved to {prefix}.jsonl and {prefix}.trace.json")
+
+# Profiling is opt-in: stage() is a no-op until enable() is called
+_active = None
+
+def enable():
+    global _active
+    _active = StageProfiler()
+    return _active
+
+def active():
+    return _active
+
+@contextmanager
+def _null_stage(args):
+    yield args
+
+def stage(name, **args):
+    """
+    Time a block as `name` when profiling is enabled. Yields the args dict so
+    callers can attach results (e.g. generated token counts).
+    """
+    if _active is None:
+        return _null_stage(args)
+    return _active.stage(name, **args)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+def example_key(audio_filepath, labels):
+    """
+    Identify a training example by its audio path(s) and label token ids, so
+    teacher outputs are found regardless of dataset order or shuffling.
+    """
+    return hashlib.sha1(json.dumps([audio_filepath, [int(token) for token in labels]]).encode()).hexdigest()
+
+class TeacherTopK:
+    """
+    On-disk store of teacher top-k log-probabilities for every label position
+    of every training example (teacher-forced on the labels).
+
+    All examples share two memory-mapped arrays of shape (total_tokens, k):
+    ids.npy (int32 token ids) and logprobs.npy (float16 log-probabilities).
+    index.json maps each example key to its (offset, length) row range and
+    done.npy marks finished examples so an interrupted teacher pass resumes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.k = self.meta["top_k"]
+        with open(os.path.join(root, "index.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.keys = index["keys"]
+        self.offsets = np.asarray(index["offsets"], dtype=np.int64)
+        self.lengths = np.asarray(index["lengths"], dtype=np.int64)
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self._arrays = None
+
+    @classmethod
+    def create(cls, root, keys, lengths, top_k, meta):
+        """
+        Preallocate a store for the given examples; an existing store with the
+        same examples and settings is reopened instead (resume).
+        """
+        meta = {**meta, "top_k": top_k, "num_examples": len(keys), "total_tokens": int(sum(lengths))}
+        meta_path = os.path.join(root, "meta.json")
+        if os.path.exists(meta_path):
+            store = cls(root)
+            if store.meta == meta and store.keys == list(keys):
+                return store
+            raise ValueError(f"{root} holds teacher outputs for different data or settings; use a new directory")
+
+        os.makedirs(root, exist_ok=True)
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64) if len(lengths) else np.zeros(0, np.int64)
+        total = max(1, meta["total_tokens"])  # Zero-sized memmaps cannot be created
+        np.lib.format.open_memmap(os.path.join(root, "ids.npy"), mode="w+", dtype=np.int32, shape=(total, top_k))
+        np.lib.format.open_memmap(os.path.join(root, "logprobs.npy"), mode="w+", dtype=np.float16, shape=(total, top_k))
+        np.lib.format.open_memmap(os.path.join(root, "done.npy"), mode="w+", dtype=np.uint8, shape=(max(1, len(keys)),))
+        with open(os.path.join(root, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"keys": list(keys), "offsets": offsets.tolist(), "lengths": [int(n) for n in lengths]}, f)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return cls(root)
+
+    def __getstate__(self):
+        # Memmaps are reopened in each DataLoader worker
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def _open(self, mode="r"):
+        if self._arrays is None or (mode == "r+" and self._arrays["mode"] != "r+"):
+            self._arrays = {
+                "mode": mode,
+                "ids": np.load(os.path.join(self.root, "ids.npy"), mmap_mode=mode),
+                "logprobs": np.load(os.path.join(self.root, "logprobs.npy"), mmap_mode=mode),
+                "done": np.load(os.path.join(self.root, "done.npy"), mmap_mode=mode),
+            }
+        return self._arrays
+
+    def is_done(self, row):
+        return bool(self._open()["done"][row])
+
+    def write(self, row, ids, logprobs):
+        """
+        Store the (length, k) top-k ids / log-probs of example row.
+        """
+        arrays = self._open("r+")
+        start, length = self.offsets[row], self.lengths[row]
+        arrays["ids"][start:start + length] = ids[:length]
+        arrays["logprobs"][start:start + length] = logprobs[:length]
+        arrays["done"][row] = 1
+
+    def flush(self):
+        if self._arrays is not None and self._arrays["mode"] == "r+":
+            for name in ("ids", "logprobs", "done"):
+                self._arrays[name].flush()
+
+    def lookup(self, audio_filepath, labels):
+        """
+        Return (ids, logprobs) of shape (len(labels), k) for an example, or
+        empty (0, k) arrays if the teacher pass did not cover it.
+        """
+        row = self.rows.get(example_key(audio_filepath, labels))
+        arrays = self._open()
+        if row is None or not arrays["done"][row] or self.lengths[row] != len(labels):
+            return np.zeros((0, self.k), dtype=np.int32), np.zeros((0, self.k), dtype=np.float16)
+        start, length = self.offsets[row], self.lengths[row]
+        return np.array(arrays["ids"][start:start + length]), np.array(arrays["logprobs"][start:start + length])
@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+from transformers import (
+    GenerationConfig,
+    WhisperConfig,
+    WhisperFeatureExtractor,
+    WhisperForConditionalGeneration,
+    WhisperProcessor,
+    WhisperTokenizer,
+)
+from transformers.models.whisper.tokenization_whisper import LANGUAGES, bytes_to_unicode
+
+def build_tiny_tokenizer():
+    """
+    Build a byte-level Whisper tokenizer (no BPE merges) with the standard
+    special tokens, entirely offline.
+    """
+    # The tokenizer reads vocab and merges into memory, so the files can go right away
+    with tempfile.TemporaryDirectory(prefix="tiny_whisper_") as vocab_dir:
+        vocab_file = os.path.join(vocab_dir, "vocab.json")
+        merges_file = os.path.join(vocab_dir, "merges.txt")
+        with open(vocab_file, "w", encoding="utf-8") as f:
+            json.dump({char: i for i, char in enumerate(bytes_to_unicode().values())}, f)
+        with open(merges_file, "w", encoding="utf-8") as f:
+            f.write("#version: 0.2\n")
+
+        tokenizer = WhisperTokenizer(vocab_file, merges_file, unk_token="<|endoftext|>",
+                                     bos_token="<|endoftext|>", eos_token="<|endoftext|>")
+    special_tokens = ["<|startoftranscript|>"] + [f"<|{code}|>" for code in LANGUAGES] + [
+        "<|translate|>", "<|transcribe|>", "<|startoflm|>", "<|startofprev|>", "<|nocaptions|>", "<|notimestamps|>",
+    ]
+    tokenizer.add_special_tokens({"additional_special_tokens": special_tokens})
+    return tokenizer
+
+def build_tiny_random_model(d_model=64, layers=1, max_length=32, seed=0):
+    """
+    Build a randomly initialised Whisper model and matching processor without
+    downloading anything. Used for local server tests and benchmarks.
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    tokenizer = build_tiny_tokenizer()
+    processor = WhisperProcessor(feature_extractor=WhisperFeatureExtractor(), tokenizer=tokenizer)
+    token_id = tokenizer.convert_tokens_to_ids
+
+    config = WhisperConfig(
+        vocab_size=len(tokenizer),
+        num_mel_bins=processor.feature_extractor.feature_size,
+        d_model=d_model,
+        encoder_layers=layers,
+        decoder_layers=layers,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=d_model * 2,
+        decoder_ffn_dim=d_model * 2,
+        max_target_positions=448,
+        pad_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        decoder_start_token_id=token_id("<|startoftranscript|>"),
+        suppress_tokens=[],
+        begin_suppress_tokens=[],
+    )
+    model = WhisperForConditionalGeneration(config)
+    model.generation_config = GenerationConfig(
+        decoder_start_token_id=config.decoder_start_token_id,
+        bos_token_id=config.bos_token_id,
+        eos_token_id=config.eos_token_id,
+        pad_token_id=config.pad_token_id,
+        no_timestamps_token_id=token_id("<|notimestamps|>"),
+        is_multilingual=True,
+        lang_to_id={f"<|{code}|>": token_id(f"<|{code}|>") for code in LANGUAGES},
+        task_to_id={"transcribe": token_id("<|transcribe|>"), "translate": token_id("<|translate|>")},
+        max_length=max_length,  # Random weights rarely emit <|endoftext|>
+    )
+    return model, processor
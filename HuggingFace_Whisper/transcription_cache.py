@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+from feature_cache import hash_file
+
+# Files whose change means a retrained / different model (quantized artifacts are derived from these)
+MODEL_FILE_SUFFIXES = (".safetensors", ".bin", ".json")
+
+def model_fingerprint(model_path):
+    """
+    (name, size, mtime) of the weight and config files of a model directory, so a
+    retrain into the same path changes the cache key without hashing the weights.
+    """
+    if os.path.isfile(model_path):
+        stat = os.stat(model_path)
+        return [[os.path.basename(model_path), stat.st_size, stat.st_mtime_ns]]
+    if not os.path.isdir(model_path):
+        return []  # e.g. a hub model id
+    fingerprint = []
+    for name in sorted(os.listdir(model_path)):
+        full_path = os.path.join(model_path, name)
+        if name.endswith(MODEL_FILE_SUFFIXES) and os.path.isfile(full_path):
+            stat = os.stat(full_path)
+            fingerprint.append([name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def write_merged_output(output_path, audio_paths, results, normalize=None):
+    """
+    Atomically write `audio_path transcription` lines in the given order.
+    normalize (e.g. transcriptions_normalize.normalize_text) is applied to each
+    transcription, so a scoring-ready hyp.txt can be written without a second pass.
+    """
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for audio_path in audio_paths:
+            transcription = results.get(audio_path)
+            if transcription:
+                if normalize is not None:
+                    transcription = normalize(transcription)
+                f.write(f"{audio_path} {transcription}\n")
+    os.replace(tmp_path, output_path)
+
+def collect_finished(audio_paths, cache):
+    """
+    Split audio_paths into finished results from the sidecar cache and the list
+    of files that still need transcribing. The previous output file is not
+    trusted: only the cache knows which model and settings produced a line.
+    """
+    transcriptions = {}
+    pending_paths = []
+    for audio_path in audio_paths:
+        cached = cache.get(audio_path)
+        if cached:
+            transcriptions[audio_path] = cached
+        else:
+            pending_paths.append(audio_path)
+    return transcriptions, pending_paths
+
+class TranscriptionCache:
+    """
+    Append-only JSONL sidecar of finished transcriptions, keyed by audio content
+    hash, model path, model file fingerprint and decode settings. Entries also
+    record size/mtime so unchanged files are recognised without re-hashing them.
+    """
+
+    def __init__(self, cache_path, model_path, decode_settings, flush_every=20):
+        settings = {"model_path": os.path.abspath(model_path), "model_files": model_fingerprint(model_path),
+                    **decode_settings}
+        self.settings_key = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+        self.flush_every = flush_every
+        self._by_hash = {}
+        self._by_stat = {}
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Truncated last line from an interrupted run
+                    if entry.get("settings") != self.settings_key:
+                        continue
+                    self._by_hash[entry["hash"]] = entry["text"]
+                    self._by_stat[(entry["path"], entry["size"], entry["mtime"])] = entry["hash"]
+
+        self._file = open(cache_path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            self._file.write("\n")  # Terminate a possibly truncated last line
+        self._unflushed = 0
+
+    def __len__(self):
+        return len(self._by_hash)
+
+    def _stat_key(self, audio_path):
+        stat = os.stat(audio_path)
+        return (audio_path, stat.st_size, stat.st_mtime)
+
+    def _hash(self, audio_path, stat_key):
+        file_hash = self._by_stat.get(stat_key)
+        if file_hash is None:
+            file_hash = hash_file(audio_path)
+            self._by_stat[stat_key] = file_hash
+        return file_hash
+
+    def get(self, audio_path):
+        """
+        Return the cached transcription for audio_path, or None.
+        """
+        try:
+            stat_key = self._stat_key(audio_path)
+            return self._by_hash.get(self._hash(audio_path, stat_key))
+        except OSError:
+            return None
+
+    def add(self, audio_path, transcription):
+        """
+        Record a finished transcription; flushed to disk every flush_every entries.
+        """
+        stat_key = self._stat_key(audio_path)
+        file_hash = self._hash(audio_path, stat_key)
+        self._by_hash[file_hash] = transcription
+        entry = {"path": audio_path, "size": stat_key[1], "mtime": stat_key[2],
+                 "hash": file_hash, "settings": self.settings_key, "text": transcription}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unflushed = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
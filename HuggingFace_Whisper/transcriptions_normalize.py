@@ -1,35 +1,60 @@
+import itertools
+import multiprocessing
 import re
 
+# 去除標點符號、將 - 換成空格（單次 str.translate 完成）
+NORMALIZE_TABLE = str.maketrans({**{char: None for char in "，。！？、．,.!?"}, "-": " "})
+# 僅對中文部分添加前後空格 (匹配 Unicode 範圍 \u4e00-\u9fff)
+CJK_RE = re.compile(r'([\u4e00-\u9fff])')
+
 def normalize_text(text):
-    # 去除標點符號
-    text = re.sub(r'[，。！？、．,.!?]', '', text)
-    text = re.sub(r'[-]', ' ', text)
-    # 僅對中文部分添加前後空格 (匹配 Unicode 範圍 \u4e00-\u9fff)
-    transcript_spaced = re.sub(r'([\u4e00-\u9fff])', r' \1 ', text)
-    transcript_spaced = re.sub(r'\s+', ' ', transcript_spaced).strip()
-    return transcript_spaced
-
-def process_file(input_file, output_file):
-    results = []
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        for line in infile:
-            # 僅拆分第一個空格，確保只影響文本部分
-            parts = line.split(' ', 1)
-            if len(parts) == 2:
-                filename, transcript = parts
-                transcript_spaced = normalize_text(transcript)
-                results.append(f"{filename} {transcript_spaced}")
-            else:
-                results.append(line.strip())
-    
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        for res in results:
-            outfile.write(res + "\n")
-    
+    # translate 後只需一次 regex，多餘空白以 split/join 合併並去除頭尾
+    return " ".join(CJK_RE.sub(r' \1 ', text.translate(NORMALIZE_TABLE)).split())
+
+def normalize_line(line):
+    # 僅拆分第一個空格，確保只影響文本部分
+    parts = line.split(' ', 1)
+    if len(parts) == 2:
+        filename, transcript = parts
+        return f"{filename} {normalize_text(transcript)}"
+    return line.strip()
+
+def iter_normalized(lines):
+    """ 逐行產生正規化結果（generator），不需整個檔案留在記憶體 """
+    for line in lines:
+        yield normalize_line(line)
+
+def normalize_lines(lines):
+    return [normalize_line(line) for line in lines]
+
+def iter_chunks(lines, chunk_lines):
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_lines))
+        if not chunk:
+            return
+        yield chunk
+
+def process_file(input_file, output_file, num_workers=1, chunk_lines=10000):
+    """
+    串流處理：邊讀邊寫。num_workers > 1 時以 chunk_lines 行為單位分給多個行程，
+    輸出順序與輸入相同。
+    """
+    with open(input_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8') as outfile:
+        if num_workers > 1:
+            with multiprocessing.Pool(num_workers) as pool:
+                for chunk in pool.imap(normalize_lines, iter_chunks(infile, chunk_lines)):
+                    outfile.write("".join(res + "\n" for res in chunk))
+        else:
+            for res in iter_normalized(infile):
+                outfile.write(res + "\n")
+
     print(f"處理完成！結果已儲存至 {output_file}")
 
 # 設定輸入和輸出文件
 input_txt = "transcriptions.txt"
 output_txt = "hyp.txt"
+num_workers = 1  # 大檔案可調高，分塊多行程處理
 
-process_file(input_txt, output_txt)
+if __name__ == "__main__":
+    process_file(input_txt, output_txt, num_workers)
@@ -0,0 +1,362 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("k2d", "HuggingFace_Whisper", "Data_prepare"):
+    sys.path.insert(0, os.path.join(REPO_ROOT, folder))
+
+# Registered benchmarks: name -> function(workdir, quick) returning {case: {"seconds": ..., ...}}
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def best_time(fn, repeat=3):
+    """
+    Best wall time of repeat calls (seconds); the minimum is the least noisy estimate.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def quiet(fn, *args, **kwargs):
+    # The scoring scripts print a line per utterance
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+# ---------------------------------------------------------------- synthetic data
+
+WORDS = ["我", "你", "他", "是", "的", "在", "有", "不", "人", "了", "hello", "world", "ok", "model", "data"]
+
+def random_edit(rng, tokens, vocab, error_rate=0.15):
+    """
+    Copy tokens with random substitutions, deletions and insertions.
+    """
+    out = []
+    for token in tokens:
+        roll = rng.random()
+        if roll < error_rate / 3:
+            continue
+        if roll < 2 * error_rate / 3:
+            out.append(rng.choice(vocab))
+        else:
+            out.append(token)
+        if rng.random() < error_rate / 3:
+            out.append(rng.choice(vocab))
+    return out
+
+def write_pairs(workdir, name, pairs):
+    ref_path = os.path.join(workdir, f"{name}_ref.txt")
+    hyp_path = os.path.join(workdir, f"{name}_hyp.txt")
+    with open(ref_path, "w", encoding="utf-8") as ref_f, open(hyp_path, "w", encoding="utf-8") as hyp_f:
+        for i, (ref, hyp) in enumerate(pairs):
+            ref_f.write(f"utt{i:06d} {' '.join(ref)}\n")
+            hyp_f.write(f"utt{i:06d} {' '.join(hyp)}\n")
+    return ref_path, hyp_path
+
+def tailo_words(rng, count):
+    from Pseudo_PER import consonants, vowels
+    words = []
+    for _ in range(count):
+        syllables = [rng.choice(["", *consonants]) + rng.choice(vowels) + rng.choice(["", "2", "3", "5", "7", "8"])
+                     for _ in range(rng.randint(1, 3))]
+        words.append("-".join(syllables))
+    return words
+
+def write_wav(path, seconds, sample_rate=16000, rng=None):
+    rng = rng or np.random.default_rng(0)
+    samples = (rng.standard_normal(int(seconds * sample_rate)) * 3000).astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(samples.tobytes())
+
+# ---------------------------------------------------------------- benchmarks
+
+@benchmark("edit_distance")
+def bench_edit_distance(workdir, quick):
+    from edit_distance import calculate_wer_details
+    rng = random.Random(0)
+    results = {}
+    for length, num_pairs in ((10, 2000), (100, 300), (1000, 20)):
+        num_pairs = max(1, num_pairs // 10) if quick else num_pairs
+        pairs = []
+        for _ in range(num_pairs):
+            ref = [rng.choice(WORDS) for _ in range(length)]
+            pairs.append((" ".join(ref), " ".join(random_edit(rng, ref, WORDS))))
+        for details in (False, True):
+            seconds = best_time(lambda: [calculate_wer_details(ref, hyp, return_details=details) for ref, hyp in pairs])
+            results[f"len={length},details={details}"] = {"seconds": seconds, "pairs_per_s": num_pairs / seconds}
+    return results
+
+@benchmark("tailo_syllable")
+def bench_tailo(workdir, quick):
+    import Pseudo_PER
+    from tailo_syllable import SyllableParser
+    rng = random.Random(0)
+    words = tailo_words(rng, 2000 if quick else 20000)
+    sentences = [" ".join(rng.choice(words) for _ in range(12)) for _ in range(len(words) // 10)]
+
+    def fresh_parser():
+        # Measure cold caches on every repeat
+        Pseudo_PER.syllable_parser = SyllableParser(Pseudo_PER.consonants, Pseudo_PER.vowels)
+
+    def run_split():
+        fresh_parser()
+        for word in words:
+            Pseudo_PER.split_pinyin(word)
+
+    def run_preprocess():
+        fresh_parser()
+        for sentence in sentences:
+            Pseudo_PER.preprocess_text(sentence)
+
+    split_seconds = best_time(run_split)
+    preprocess_seconds = best_time(run_preprocess)
+    return {
+        "split_pinyin": {"seconds": split_seconds, "words_per_s": len(words) / split_seconds},
+        "preprocess_text": {"seconds": preprocess_seconds, "sentences_per_s": len(sentences) / preprocess_seconds},
+    }
+
+@benchmark("pseudo_scoring")
+def bench_pseudo_scoring(workdir, quick):
+    import Pseudo_MER
+    import Pseudo_PER
+    rng = random.Random(0)
+    num_utts = 500 if quick else 5000
+    word_pairs = []
+    for _ in range(num_utts):
+        ref = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+        word_pairs.append((ref, random_edit(rng, ref, WORDS)))
+    mer_ref, mer_hyp = write_pairs(workdir, "pseudo_mer", word_pairs)
+
+    vocab = tailo_words(rng, 2000)
+    tailo_pairs = []
+    for _ in range(num_utts):
+        ref = [rng.choice(vocab) for _ in range(rng.randint(3, 20))]
+        tailo_pairs.append((ref, random_edit(rng, ref, vocab)))
+    per_ref, per_hyp = write_pairs(workdir, "pseudo_per", tailo_pairs)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)  # error_log.txt is written to the working directory
+    try:
+        mer_seconds = best_time(lambda: quiet(Pseudo_MER.calculate_wer_from_files, mer_ref, mer_hyp,
+                                              os.path.join(workdir, "Pseudo_MER.txt")), repeat=1)
+        per_seconds = best_time(lambda: quiet(Pseudo_PER.calculate_wer_from_files, per_ref, per_hyp,
+                                              os.path.join(workdir, "Pseudo_PER.txt"), num_workers=1), repeat=1)
+    finally:
+        os.chdir(cwd)
+    return {
+        "Pseudo_MER": {"seconds": mer_seconds, "utts_per_s": num_utts / mer_seconds},
+        "Pseudo_PER": {"seconds": per_seconds, "utts_per_s": num_utts / per_seconds},
+    }
+
+@benchmark("mer")
+def bench_mer(workdir, quick):
+    import MER
+    rng = random.Random(0)
+    num_utts = 300 if quick else 3000
+    pairs = []
+    for _ in range(num_utts):
+        ref = [rng.choice(WORDS) for _ in range(rng.randint(5, 40))]
+        pairs.append((ref, random_edit(rng, ref, WORDS)))
+    ref_path, hyp_path = write_pairs(workdir, "mer", pairs)
+    output_path = os.path.join(workdir, "mer_results.txt")
+    cache_path = os.path.join(workdir, "mer_score_cache.sqlite")
+
+    cold_seconds = best_time(lambda: quiet(MER.calculate_wer_with_highlights_by_id, ref_path, hyp_path,
+                                           output_path, num_workers=1), repeat=1)
+    quiet(MER.calculate_wer_with_highlights_by_id, ref_path, hyp_path, output_path, num_workers=1,
+          score_cache_file=cache_path)
+    cached_seconds = best_time(lambda: quiet(MER.calculate_wer_with_highlights_by_id, ref_path, hyp_path,
+                                             output_path, num_workers=1, score_cache_file=cache_path), repeat=1)
+    return {
+        "single_process": {"seconds": cold_seconds, "utts_per_s": num_utts / cold_seconds},
+        "score_cache_hit": {"seconds": cached_seconds, "utts_per_s": num_utts / cached_seconds},
+    }
+
+@benchmark("normalize")
+def bench_normalize(workdir, quick):
+    import transcriptions_normalize
+    rng = random.Random(0)
+    punctuation = list("，。！？、．,.!?-")
+    num_lines = 10000 if quick else 100000
+    lines = []
+    for i in range(num_lines):
+        tokens = [rng.choice(WORDS + punctuation) for _ in range(rng.randint(5, 40))]
+        lines.append(f"audio/utt{i:06d}.wav {''.join(tokens)}\n")
+    input_path = os.path.join(workdir, "transcriptions.txt")
+    with open(input_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+    text_seconds = best_time(lambda: [transcriptions_normalize.normalize_text(line) for line in lines])
+    file_seconds = best_time(lambda: quiet(transcriptions_normalize.process_file, input_path,
+                                           os.path.join(workdir, "hyp.txt")))
+    return {
+        "normalize_text": {"seconds": text_seconds, "lines_per_s": num_lines / text_seconds},
+        "process_file": {"seconds": file_seconds, "lines_per_s": num_lines / file_seconds},
+    }
+
+@benchmark("codeswitch")
+def bench_codeswitch(workdir, quick):
+    import CodeSwitch_Data_merge as codeswitch
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    clips_per_language = 60 if quick else 300
+    languages = {}
+    for lang in codeswitch.lang_tags:
+        language_path = os.path.join(workdir, "codeswitch", lang)
+        os.makedirs(os.path.join(language_path, "audio"), exist_ok=True)
+        with open(os.path.join(language_path, "transcripts.txt"), "w", encoding="utf-8") as f:
+            for i in range(clips_per_language):
+                write_wav(os.path.join(language_path, "audio", f"{lang}_{i}.wav"), rng.uniform(0.5, 8.0), rng=np_rng)
+                f.write(f"{lang}_{i} {' '.join(rng.choice(WORDS) for _ in range(5))}\n")
+        languages[lang] = language_path
+
+    def load_all():
+        return {lang: quiet(codeswitch.load_transcripts, path, lang) for lang, path in languages.items()}
+
+    start = time.perf_counter()
+    all_data = load_all()
+    cold_seconds = time.perf_counter() - start
+    warm_seconds = best_time(load_all)
+
+    num_picks = 2000 if quick else 20000
+    indexes, available_languages = codeswitch.build_indexes(all_data)
+    pick_rng = random.Random(0)
+    pick_seconds = best_time(lambda: [codeswitch.pick_clips(pick_rng, indexes, available_languages, 2, codeswitch.max_length_for(2))
+                                      for _ in range(num_picks)])
+
+    num_samples = 50 if quick else 300
+    codeswitch.output_audio_folder = os.path.join(workdir, "codeswitch", "out")
+    os.makedirs(codeswitch.output_audio_folder, exist_ok=True)
+    codeswitch.init_worker(all_data)
+    jobs = [(k, 2 + k % 2) for k in range(num_samples)]
+    synth_seconds = best_time(lambda: codeswitch.generate_samples(jobs), repeat=1)
+    return {
+        "load_transcripts_cold": {"seconds": cold_seconds, "clips": clips_per_language * len(languages)},
+        "load_transcripts_warm": {"seconds": warm_seconds, "clips": clips_per_language * len(languages)},
+        "pick_clips": {"seconds": pick_seconds, "picks_per_s": num_picks / pick_seconds},
+        "generate_samples": {"seconds": synth_seconds, "samples_per_s": num_samples / synth_seconds},
+    }
+
+@benchmark("inference")
+def bench_inference(workdir, quick):
+    import KTG_inference
+    from tiny_whisper import build_tiny_random_model
+
+    audio_folder = os.path.join(workdir, "inference_audio")
+    os.makedirs(audio_folder, exist_ok=True)
+    np_rng = np.random.default_rng(0)
+    num_files = 4 if quick else 16
+    seconds_per_file = 10.0
+    for i in range(num_files):
+        write_wav(os.path.join(audio_folder, f"clip_{i}.wav"), seconds_per_file, rng=np_rng)
+
+    KTG_inference.feature_cache_dir = None
+    KTG_inference.set_model(*build_tiny_random_model())
+    output_path = os.path.join(workdir, "transcriptions.txt")
+    seconds = best_time(lambda: quiet(KTG_inference.transcribe_folder, audio_folder, output_path,
+                                      batch_size=4, num_workers=2, resume=False), repeat=1 if quick else 2)
+    audio_seconds = num_files * seconds_per_file
+    return {"tiny_whisper": {"seconds": seconds, "audio_seconds": audio_seconds, "rtf": seconds / audio_seconds}}
+
+# ---------------------------------------------------------------- reporting
+
+def compare(results, baseline, threshold):
+    """
+    Print seconds against the baseline; return the cases slower than threshold x baseline.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<50} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, cases in results.items():
+        for case, metrics in cases.items():
+            key = f"{name}/{case}"
+            base = baseline.get("results", {}).get(name, {}).get(case)
+            if base is None:
+                print(f"{key:<50} {'-':>10} {metrics['seconds']:>10.4f} {'new':>7}")
+                continue
+            ratio = metrics["seconds"] / max(base["seconds"], 1e-12)
+            flag = " ⚠️" if ratio > threshold else ""
+            print(f"{key:<50} {base['seconds']:>10.4f} {metrics['seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+            if ratio > threshold:
+                regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline CPU benchmarks of the repo's hot paths on synthetic data.")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs for a fast smoke run")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"),
+                        help="Stored results to compare against (skipped if missing)")
+    parser.add_argument("--save-baseline", action="store_true", help="Also store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any case regresses")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ktg_bench_") as workdir:
+        for name in args.only or BENCHMARKS:
+            print(f"⏱️  {name} ...")
+            bench_dir = os.path.join(workdir, name)
+            os.makedirs(bench_dir)
+            results[name] = BENCHMARKS[name](bench_dir, args.quick)
+            for case, metrics in results[name].items():
+                extras = ", ".join(f"{key}={value:.4g}" for key, value in metrics.items() if key != "seconds")
+                print(f"   {case}: {metrics['seconds']:.4f}s ({extras})")
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Results saved to {args.output}")
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("quick") != args.quick:
+            print("⚠️ Baseline was recorded with a different --quick setting; ratios are not comparable")
+        regressions = compare(results, baseline, args.threshold)
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.2f}x")
+    else:
+        print(f"No baseline at {args.baseline} (use --save-baseline to create one)")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"📌 Baseline saved to {args.baseline}")
+
+    if args.fail_on_regression and regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
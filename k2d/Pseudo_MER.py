@@ -1,36 +1,8 @@
-import numpy as np
+from edit_distance import calculate_wer_details
 
 def normalize_spacing(text):
     return " ".join(text.split())
 
-def calculate_wer_details(reference, hypothesis):
-    reference = reference.lower().strip()
-    hypothesis = hypothesis.lower().strip()
-
-    ref_words = reference.split()
-    hyp_words = hypothesis.split()
-    len_ref = len(ref_words)
-    len_hyp = len(hyp_words)
-
-    # 建立 DP 
-    dp = np.zeros((len_ref + 1, len_hyp + 1), dtype=np.int32)
-    for i in range(len_ref + 1):
-        dp[i][0] = i
-    for j in range(len_hyp + 1):
-        dp[0][j] = j
-
-    for i in range(1, len_ref + 1):
-        for j in range(1, len_hyp + 1):
-            if ref_words[i - 1] == hyp_words[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1]
-            else:
-                dp[i][j] = min(dp[i - 1][j] + 1,  # 刪除
-                               dp[i][j - 1] + 1,  # 插入
-                               dp[i - 1][j - 1] + 1)  # 替換
-
-    wer_value = dp[len_ref][len_hyp] / max(1, len_ref)
-    return wer_value
-
 def calculate_wer_from_files(ref_file, hyp_file, output_file):
     # 讀取參考文本
     ref_dict = {}
@@ -94,9 +66,10 @@ def calculate_wer_from_files(ref_file, hyp_file, output_file):
 
     print(f"📄 WER 結果已保存至 {output_file}")
 
-# 模型轉錄文本路徑
-teacher_model_transcriptions = "teacher.txt"
-student_model_transcriptions = "student.txt"
-output_file = "Pseudo_MER.txt"
+if __name__ == "__main__":
+    # 模型轉錄文本路徑
+    teacher_model_transcriptions = "teacher.txt"
+    student_model_transcriptions = "student.txt"
+    output_file = "Pseudo_MER.txt"
 
-calculate_wer_from_files(teacher_model_transcriptions, student_model_transcriptions, output_file)
+    calculate_wer_from_files(teacher_model_transcriptions, student_model_transcriptions, output_file)
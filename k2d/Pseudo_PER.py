@@ -1,5 +1,7 @@
-import numpy as np
-import re
+import multiprocessing
+import os
+from edit_distance import edit_distance
+from tailo_syllable import SyllableParser
 
 # 定義聲母（initials）與韻母（finals）
 consonants = ['p', 'ph', 'm', 'b', 't', 'th', 'n', 'l', 'k', 'kh', 'ng', 'g', 'ts', 'tsh', 's', 'j', 'h']
@@ -29,118 +31,134 @@ vowels = sorted([
     'uai', 'uaih', 'uainn', 'uainnh'
 ], key=len, reverse=True)  # 確保長韻母優先匹配
 
+# 音節解析器（反向後綴 trie + 解析結果快取）
+syllable_parser = SyllableParser(consonants, vowels)
+
 def preprocess_text(text):
     """ 去除聲調數字和 '-'，並執行 initial-final 拆分 """
-    text = text.lower()  # 英文正規化為小寫
-    text = re.sub(r'[-\d]', ' ', text)  # 去掉調號
-    words = text.split()
-    split_words = []
-
-    for word in words:
-        initial, final = split_pinyin(word)
-        if initial and final:
-            split_words.append(initial + " " + final)
-        elif final:
-            split_words.append("- " + final)
-    
-    return " ".join(split_words)
+    return " ".join(syllable_parser.tokenize(text))
 
 def split_pinyin(word):
     """ 拆分聲母（initial）與韻母（final） """
-    for vowel in vowels:
-        if word.endswith(vowel):
-            initial = word[:-len(vowel)]
-            if initial in consonants:
-                return initial, vowel
-            else:
-                return ' ', word  # 沒有聲母時當作韻母
-    return None, None
+    return syllable_parser.split(word)
 
 def normalize_spacing(text):
     """ 確保文本空格一致 """
     return " ".join(text.split())
 
-def calculate_wer_details(reference, hypothesis):
+def load_hypotheses(hyp_file):
+    """ 讀取假設文本為 {音檔 ID: 文本}，格式錯誤的行回傳於 malformed """
+    hyp_dict = {}
+    malformed = []
+    with open(hyp_file, 'r', encoding='utf-8') as hyp_f:
+        for idx, line in enumerate(hyp_f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if " " not in line:
+                malformed.append(f"Hypothesis line {idx} is malformed: '{line}'")
+                continue
+            hyp_id, hyp_text = line.split(' ', 1)
+            hyp_dict[hyp_id] = hyp_text
+    return hyp_dict, malformed
+
+def score_chunk(chunk):
     """
-    計算 WER（Word Error Rate），並標記錯誤類型（插入 I、刪除 D、替換 S）
+    計算一批 (行號, ID, 參考文本, 假設文本) 的 PER（於子行程中執行）。
+    回傳 (ID, 參考音素, 假設音素, PER, 錯誤數, 參考長度) 的 list。
     """
-    reference = reference.lower().strip()
-    hypothesis = hypothesis.lower().strip()
-
-    ref_words = reference.split()
-    hyp_words = hypothesis.split()
-    len_ref = len(ref_words)
-    len_hyp = len(hyp_words)
-
-    # 建立 DP 表
-    dp = np.zeros((len_ref + 1, len_hyp + 1), dtype=np.int32)
-    for i in range(len_ref + 1):
-        dp[i][0] = i
-    for j in range(len_hyp + 1):
-        dp[0][j] = j
-
-    for i in range(1, len_ref + 1):
-        for j in range(1, len_hyp + 1):
-            if ref_words[i - 1] == hyp_words[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1]
-            else:
-                dp[i][j] = min(dp[i - 1][j] + 1,  # 刪除
-                               dp[i][j - 1] + 1,  # 插入
-                               dp[i - 1][j - 1] + 1)  # 替換
-
-    wer_value = dp[len_ref][len_hyp] / max(1, len_ref)
-
-    return wer_value
-
-def calculate_wer_from_files(ref_file, hyp_file, output_file):
-    with open(ref_file, 'r', encoding='utf-8') as ref_f, open(hyp_file, 'r', encoding='utf-8') as hyp_f:
-        ref_lines = ref_f.readlines()
-        hyp_lines = hyp_f.readlines()
-
-    output = []
-    error_log = []
-
-    for idx, (ref_line, hyp_line) in enumerate(zip(ref_lines, hyp_lines), start=1):
-        try:
+    results = []
+    for idx, ref_id, ref_text, hyp_text in chunk:
+        ref_ids = syllable_parser.encode(ref_text)
+        hyp_ids = syllable_parser.encode(hyp_text)
+        errors = edit_distance(ref_ids, hyp_ids)
+        per = errors / max(1, len(ref_ids))
+        results.append((ref_id, syllable_parser.decode(ref_ids), syllable_parser.decode(hyp_ids), per, errors, len(ref_ids)))
+    return results
+
+def iter_chunks(ref_file, hyp_dict, error_log, chunk_size):
+    """ 串流讀取參考文本，依音檔 ID 配對假設文本並切成 chunk """
+    chunk = []
+    with open(ref_file, 'r', encoding='utf-8') as ref_f:
+        for idx, ref_line in enumerate(ref_f, start=1):
             ref_line = ref_line.strip()
-            hyp_line = hyp_line.strip()
-            if " " not in ref_line or " " not in hyp_line:
-                raise ValueError(f"Line {idx} is malformed: '{ref_line}' | '{hyp_line}'")
-
+            if not ref_line:
+                continue
+            if " " not in ref_line:
+                error_log.append(f"❌ Line {idx} Error: Line {idx} is malformed: '{ref_line}'")
+                continue
             ref_id, ref_text = ref_line.split(' ', 1)
-            hyp_id, hyp_text = hyp_line.split(' ', 1)
-
-            ref_text = normalize_spacing(preprocess_text(ref_text))
-            hyp_text = normalize_spacing(preprocess_text(hyp_text))
-
-            wer = calculate_wer_details(ref_text, hyp_text)
-
-            output.append(f"File: {ref_id}")
-            output.append(f"Reference: {ref_text}")
-            output.append(f"Hypothesis: {hyp_text}")
-            output.append(f"PER: {wer:.4f}")
-            output.append("=" * 50)
-
-            print(f"✅ 計算 {ref_id}: WER={wer:.4f}")
-
-        except ValueError as e:
-            error_log.append(f"❌ Line {idx} Error: {e}")
-            print(f"❌ Line {idx} Error: {e}")
-            continue  # 跳過這一行
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(output))
+            hyp_text = hyp_dict.pop(ref_id, None)
+            if hyp_text is None:
+                error_log.append(f"❌ Missing hypothesis for {ref_id}")
+                continue
+            chunk.append((idx, ref_id, ref_text, hyp_text))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def calculate_wer_from_files(ref_file, hyp_file, output_file, num_workers=None, chunk_size=2000):
+    """
+    以音檔 ID 配對教師（ref）與學生（hyp）文本計算 PER。
+    參考文本以串流方式分 chunk 交給行程池計算，結果依原順序逐批寫出，
+    最後輸出逐句平均 PER 與依參考長度加權的語料 PER。
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    hyp_dict, error_log = load_hypotheses(hyp_file)
+    error_log = [f"❌ {message}" for message in error_log]
+
+    total_per = 0.0
+    total_errors = 0
+    total_ref_len = 0
+    matched = 0
+
+    chunks = iter_chunks(ref_file, hyp_dict, error_log, chunk_size)
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    try:
+        results = pool.imap(score_chunk, chunks) if pool else map(score_chunk, chunks)
+        with open(output_file, "w", encoding="utf-8") as f:
+            for chunk_results in results:
+                for ref_id, ref_text, hyp_text, per, errors, ref_len in chunk_results:
+                    f.write(f"File: {ref_id}\n")
+                    f.write(f"Reference: {ref_text}\n")
+                    f.write(f"Hypothesis: {hyp_text}\n")
+                    f.write(f"PER: {per:.4f}\n")
+                    f.write("=" * 50 + "\n")
+                    total_per += per
+                    total_errors += errors
+                    total_ref_len += ref_len
+                    matched += 1
+                print(f"✅ 已計算 {matched} 句")
+
+            avg_per = total_per / matched if matched > 0 else 0
+            corpus_per = total_errors / total_ref_len if total_ref_len > 0 else 0
+            f.write(f"平均 PER: {avg_per:.4f}\n")
+            f.write(f"語料 PER（依參考長度加權）: {corpus_per:.4f}")
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    # 未被配對到的假設文本
+    for hyp_id in hyp_dict:
+        error_log.append(f"❌ Missing reference for {hyp_id}")
+
+    print(f"平均 PER: {avg_per:.4f}")
+    print(f"語料 PER（依參考長度加權）: {corpus_per:.4f}")
 
     if error_log:
         with open("error_log.txt", "w", encoding="utf-8") as f:
             f.write("\n".join(error_log))
-        print("⚠️ 部分行有問題，已記錄到 error_log.txt")
+        print(f"⚠️ {len(error_log)} 行有問題，已記錄到 error_log.txt")
 
-    print(f"📄 WER 結果已保存至 {output_file}")
+    print(f"📄 PER 結果已保存至 {output_file}")
 
-# 使用方法
-teacher_model_transcriptions = "teacher.txt"
-student_model_transcriptions = "student.txt"
-output_file = "Pseudo_PER.txt"
+if __name__ == "__main__":
+    # 使用方法
+    teacher_model_transcriptions = "teacher.txt"
+    student_model_transcriptions = "student.txt"
+    output_file = "Pseudo_PER.txt"
 
-calculate_wer_from_files(teacher_model_transcriptions, student_model_transcriptions, output_file)
+    calculate_wer_from_files(teacher_model_transcriptions, student_model_transcriptions, output_file)